@@ -0,0 +1 @@
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Compares AnnoyVectorIndex and FaissVectorIndex on the same states:
+
+    python3 -m benchmarks.bench_index --states states.h5 --data decoder_out \
+        --faiss_options="-index_type IVF256,Flat -nprobe 8" --output report.json
+
+Both indices are built with the scripts of scripts/ (or loaded with
+--annoy/--faiss). For each index, the report lists:
+- build time
+- size on disk
+- resident memory and load time
+- single query and batched get_closest_x latency
+- recall@k against an exact search over the same states
+
+Every index is loaded and measured in a fresh process, so memory
+and load time are not skewed by the other index.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from benchmarks.synthetic import ROOT, build_index
+from index.sentenceOffsets import without_padding
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+parser = argparse.ArgumentParser(
+    description='benchmark annoy vs. faiss indices of the same states',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--states", type=str, default='',
+                    help="HDF5 file with the states (seqs x slens x hid)")
+parser.add_argument("--data", type=str, default='decoder_out',
+                    help="Which set within the states to use")
+parser.add_argument("--index", type=str, nargs='+',
+                    default=['annoy', 'faiss'], choices=['annoy', 'faiss'],
+                    help="Index types to compare")
+parser.add_argument("--annoy", type=str, default='',
+                    help="Existing annoy index of the states (not rebuilt)")
+parser.add_argument("--faiss", type=str, default='',
+                    help="Existing faiss index of the states (not rebuilt)")
+parser.add_argument("--annoy_options", type=str, default='-trees 50',
+                    help="Options for scripts/h5_to_annoy.py")
+parser.add_argument("--faiss_options", type=str, default='',
+                    help="Options for scripts/h5_to_faiss.py")
+parser.add_argument("--stepsize", type=int, default=100,
+                    help="Sequences read at once from the states")
+parser.add_argument("--k", type=int, default=10,
+                    help="Number of nearest neighbors")
+parser.add_argument("--queries", type=int, default=200,
+                    help="Number of queries (states sampled from the data)")
+parser.add_argument("--batch", type=int, default=50,
+                    help="Queries per batched get_closest_x call")
+parser.add_argument("--output", type=str, default='index_report.json',
+                    help="JSON report")
+parser.add_argument("--measure", type=str, default='',
+                    help=argparse.SUPPRESS)  # internal: measure one index
+
+
+def option(options, name, default=None):
+    """ :return: value of `-name` in a list of script options """
+    if '-' + name in options:
+        return options[options.index('-' + name) + 1]
+    return default
+
+
+def rss_mb():
+    """ resident memory of this process in MB """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_states(file_name, data, stepsize=100):
+    """
+    :param stepsize: sequences read at once -- the padded states are
+                     never loaded as a whole
+    :return: the real (non padding) token states as float32 (n x hid), in
+             the order the index scripts add them -- i.e. index ids
+    """
+    chunks = []
+    with h5py.File(file_name, 'r') as f:
+        states = f[data]
+        for ix in range(0, states.shape[0], stepsize):
+            vectors, _ = without_padding(
+                np.array(states[ix:ix + stepsize], dtype='float32'))
+            chunks.append(vectors)
+    return np.concatenate(chunks) if chunks \
+        else np.zeros((0, states.shape[2]), dtype='float32')
+
+
+def exact_neighbors(vectors, queries, k, metric, chunk_size=1024):
+    """ :return: ids (len(queries) x k) of an exact search """
+    if metric == 'angular':
+        vectors = vectors / np.maximum(
+            np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(
+            np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    res = []
+    for start in range(0, len(queries), chunk_size):
+        q = queries[start:start + chunk_size]
+        if metric == 'l2':
+            scores = -(np.sum(vectors ** 2, axis=1)[None, :]
+                       - 2 * q.dot(vectors.T))
+        else:
+            scores = q.dot(vectors.T)
+        top = np.argpartition(-scores, k, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        res.append(np.take_along_axis(top, order, axis=1))
+    return np.vstack(res)
+
+
+def recall(found, exact):
+    """ :return: mean fraction of the exact neighbors that were found """
+    return float(np.mean([len(set(f) & set(e.tolist())) / len(e)
+                          for f, e in zip(found, exact)]))
+
+
+def disk_size_mb(file_name):
+    files = [file_name, file_name + '.offsets.npy', file_name + '.vectors']
+    return sum(os.path.getsize(f) for f in files
+               if os.path.exists(f)) / 1024 / 1024
+
+
+def measure(spec):
+    """
+    loads one index and times its queries -- runs in its own process
+
+    :return: dict of measurements and the found ids for the recall
+    """
+    queries = np.load(spec['queries'])
+    k = spec['k']
+    if spec['type'] == 'annoy':
+        from index.annoyVectorIndex import AnnoyVectorIndex
+        rss = rss_mb()
+        start = time.time()
+        index = AnnoyVectorIndex(spec['index'], dim_vector=queries.shape[1],
+                                 metric=spec['metric'])
+    else:
+        from index.faissVectorIndex import FaissVectorIndex
+        rss = rss_mb()
+        start = time.time()
+        index = FaissVectorIndex(spec['index'], dim_vector=queries.shape[1],
+                                 nprobe=spec.get('nprobe'),
+                                 efSearch=spec.get('efSearch'))
+    res = {'load_s': time.time() - start}
+    res['rss_mb'] = rss_mb() - rss
+
+    found = []
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        found.append(index.get_closest_x([q.tolist()], k=k,
+                                         use_vectors=True)[0])
+        times.append((time.perf_counter() - start) * 1000)
+    res['single_ms'] = {'median': float(np.median(times)),
+                        'p95': float(np.percentile(times, 95))}
+
+    times = []
+    batch = spec['batch']
+    for start_q in range(0, len(queries), batch):
+        chunk = [q.tolist() for q in queries[start_q:start_q + batch]]
+        start = time.perf_counter()
+        index.get_closest_x(chunk, k=k, use_vectors=True)
+        times.append((time.perf_counter() - start) * 1000 / len(chunk))
+    res['batched_ms_per_query'] = float(np.median(times))
+    res['found'] = found
+    return res
+
+
+def measure_in_subprocess(spec, work):
+    spec_file = os.path.join(work, spec['type'] + '.spec.json')
+    with open(spec_file, 'w') as f:
+        json.dump(spec, f)
+    out = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.bench_index', '--measure',
+         spec_file], cwd=ROOT)
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    opt = parser.parse_args()
+    if opt.measure:
+        with open(opt.measure, 'r') as f:
+            print(json.dumps(measure(json.load(f))))
+        return
+    if not opt.states:
+        parser.error('--states is required')
+
+    work = tempfile.mkdtemp(prefix='s2s-index-bench-')
+    vectors = load_states(opt.states, opt.data, stepsize=opt.stepsize)
+    rnd = np.random.RandomState(0)
+    queries = vectors[rnd.choice(len(vectors), min(opt.queries, len(vectors)),
+                                 replace=False)]
+    queries_file = os.path.join(work, 'queries.npy')
+    np.save(queries_file, queries)
+    print('{} states of dim {}, {} queries'.format(
+        len(vectors), vectors.shape[1], len(queries)))
+
+    report = {'states': os.path.abspath(opt.states), 'data': opt.data,
+              'vectors': len(vectors), 'dim': int(vectors.shape[1]),
+              'k': opt.k, 'queries': len(queries), 'indices': {}}
+    for index_type in opt.index:
+        options = getattr(opt, index_type + '_options').split()
+        file_name = getattr(opt, index_type)
+        res = {'options': ' '.join(options)}
+        if file_name:
+            res['build_s'] = None
+        else:
+            file_name = os.path.join(work, 'index.' + index_type)
+            print('building', index_type, res['options'])
+            res['build_s'] = build_index(index_type, opt.states, opt.data,
+                                         file_name, options)
+        res['file'] = file_name
+        res['disk_mb'] = disk_size_mb(file_name)
+
+        if index_type == 'annoy':
+            metric = option(options, 'metric', 'angular')
+            exact_metric = {'angular': 'angular', 'euclidean': 'l2',
+                            'dot': 'ip'}[metric]
+        else:
+            metric = option(options, 'metric', 'ip')
+            exact_metric = metric
+        spec = {'type': index_type, 'index': file_name, 'metric': metric,
+                'queries': queries_file, 'k': opt.k, 'batch': opt.batch}
+        for name in ['nprobe', 'efSearch']:
+            if option(options, name):
+                spec[name] = int(option(options, name))
+
+        measured = measure_in_subprocess(spec, work)
+        found = measured.pop('found')
+        res.update(measured)
+        res['recall_at_k'] = recall(
+            found, exact_neighbors(vectors, queries, opt.k, exact_metric))
+        report['indices'][index_type] = res
+        print(index_type, json.dumps(res, indent=1))
+
+    with open(opt.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('report written to', opt.output)
+
+
+if __name__ == '__main__':
+    main()
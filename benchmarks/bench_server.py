@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Times the request path of the server on a random project with the stub
+model backend (no torch, no trained model, no network -- runs on any CPU):
+
+    python3 -m benchmarks.bench_server --index annoy faiss \
+        --lengths 5 20 50 --k 10 100 --output bench.json
+
+Benchmarks get_translation (cold and cached, with and without
+neighbors), all_neighbors, get_close_words, get_train_for_index and
+the LRU cache.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_project, random_sentence
+from s2s.lru import LRU
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+parser = argparse.ArgumentParser(
+    description='benchmark the server on a synthetic project',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--index", type=str, nargs='+', default=['annoy'],
+                    choices=['annoy', 'faiss'],
+                    help="Index types to benchmark (one project each)")
+parser.add_argument("--lengths", type=int, nargs='+', default=[5, 20, 50],
+                    help="Sentence lengths")
+parser.add_argument("--k", type=int, nargs='+', default=[10, 100],
+                    help="Numbers of nearest neighbors")
+parser.add_argument("--p_method", type=str, default='tsne',
+                    choices=['pca', 'mds', 'tsne'],
+                    help="Projection method of the neighborhoods")
+parser.add_argument("--sentences", type=int, default=200,
+                    help="Sentences in the synthetic training data")
+parser.add_argument("--vocab", type=int, default=1000,
+                    help="Vocabulary size of the synthetic project")
+parser.add_argument("--repeat", type=int, default=5,
+                    help="Runs per benchmark")
+parser.add_argument("--output", type=str, default='',
+                    help="Write the results as JSON to this file")
+
+
+def measure(fn, repeat):
+    """ :return: timings of `repeat` calls of fn in ms """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {'min_ms': round(min(times), 3),
+            'median_ms': round(float(np.median(times)), 3),
+            'mean_ms': round(float(np.mean(times)), 3),
+            'runs': repeat}
+
+
+class Bench:
+    def __init__(self, opt):
+        self.opt = opt
+        self.results = []
+        self.seed = 0
+
+    def run(self, name, fn, **params):
+        res = dict(benchmark=name, **params)
+        res.update(measure(fn, self.opt.repeat))
+        self.results.append(res)
+        print('{:<22} {:<50} median {:>10.2f} ms  min {:>10.2f} ms'.format(
+            name, ' '.join('{}={}'.format(k, v) for k, v in params.items()),
+            res['median_ms'], res['min_ms']))
+
+    def sentence(self, length):
+        # a new sentence for every call -- misses all caches
+        self.seed += 1
+        return random_sentence(length, self.opt.vocab, seed=self.seed)
+
+
+def bench_project(bench, server, project_id):
+    opt = bench.opt
+    project = server.projects.get(project_id)
+    server.NEIGHBOR_P_METHOD = opt.p_method
+
+    for length in opt.lengths:
+        for neighbors in [[], ['encoder', 'decoder']]:
+            for k in (opt.k if neighbors else [0]):
+                server.NEIGHBOR_K = k
+                request = lambda s: {'in': s, 'project_id': project_id,
+                                     'neighbors': neighbors or ['']}
+                bench.run('get_translation', lambda: server.get_translation(
+                    **request(bench.sentence(length))),
+                          project=project_id, length=length,
+                          neighbors=len(neighbors), k=k)
+
+                cached = request(bench.sentence(length))
+                server.get_translation(**cached)
+                bench.run('get_translation_hit',
+                          lambda: server.get_translation(**cached),
+                          project=project_id, length=length,
+                          neighbors=len(neighbors), k=k)
+
+        translations = server.translate(project, [bench.sentence(length)])
+        for k in opt.k:
+            # all_neighbors adds the neighbors to the translations
+            copies = [copy.deepcopy(translations) for _ in range(opt.repeat)]
+            bench.run('all_neighbors', lambda: server.all_neighbors(
+                project, copies.pop(), ['encoder', 'decoder'],
+                p_method=opt.p_method, k=k),
+                      project=project_id, length=length, k=k)
+
+    for limit in opt.k:
+        bench.run('get_close_words', lambda: server.get_close_words(
+            **{'in': 'w10', 'loc': 'src', 'limit': limit,
+               'p_method': opt.p_method, 'project_id': project_id}),
+                  project=project_id, limit=limit)
+
+    offsets = project.get_index('decoder').sentences
+    rnd = np.random.RandomState(0)
+    for n in opt.k:
+        sentences = rnd.randint(0, opt.sentences, size=n)
+        lengths = np.diff(offsets.offsets)[sentences] \
+            if offsets.offsets is not None else offsets.stride
+        ids = offsets.to_ids(sentences,
+                             (rnd.rand(n) * lengths).astype('int64'))
+        bench.run('get_train_for_index',
+                  lambda: project.get_train_for_index(ids.tolist()),
+                  project=project_id, ids=n)
+
+
+def bench_lru(bench, operations=1000):
+    for size in [20, 50, 200]:
+        lru = LRU(size)
+        for i in range(size):
+            lru.add('key {}'.format(i), i)
+        keys = ['key {}'.format(i) for i in
+                np.random.RandomState(0).randint(0, 2 * size, operations)]
+
+        def lookups():
+            for key in keys:
+                if lru.get(key) is None:
+                    lru.add(key, key)
+
+        bench.run('lru_get_add', lookups, size=size, operations=operations)
+
+
+def main():
+    opt = parser.parse_args()
+    work = tempfile.mkdtemp(prefix='s2s-bench-')
+    empty = os.path.join(work, 'empty')
+    os.makedirs(empty)
+
+    # the server registers the projects of --dir when it is imported --
+    # start it without any and add the synthetic projects afterwards
+    sys.argv = [sys.argv[0], '--dir', empty, '--load_threads', '0']
+    import server
+
+    bench = Bench(opt)
+    for index_type in opt.index:
+        directory = os.path.join(work, index_type)
+        print('generating project', directory)
+        make_project(directory, index_type, vocab_size=opt.vocab,
+                     sentences=opt.sentences)
+        server.projects.register(index_type, directory)
+        bench_project(bench, server, index_type)
+    bench_lru(bench)
+
+    if opt.output:
+        with open(opt.output, 'w') as f:
+            json.dump(bench.results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
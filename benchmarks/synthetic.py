@@ -0,0 +1,119 @@
+"""
+Generates a small random project (dictionaries, embeddings, training data,
+encoder/decoder states and their indices) with the layout of a real one,
+so the server can be benchmarked offline without a trained model.
+"""
+import os
+import subprocess
+import sys
+import time
+
+import h5py
+import numpy as np
+import yaml
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# AnnoyVectorIndex is loaded with its default dimension
+DIM = 500
+SPECIAL_TOKENS = ['<unk>', '<blank>', '<s>', '</s>']
+INDEX_EXTENSIONS = {'annoy': '.ann', 'faiss': '.faiss'}
+INDEX_SCRIPTS = {'annoy': 'h5_to_annoy.py', 'faiss': 'h5_to_faiss.py'}
+
+
+def build_index(index_type, states_file, data, output, options=()):
+    """
+    builds an index with the script of scripts/ for `index_type`
+
+    :param data: dataset within the states file, e.g. 'decoder_out'
+    :param options: further command line options of the script
+    :return: build time in seconds
+    """
+    start = time.time()
+    subprocess.check_call(
+        [sys.executable, os.path.join(ROOT, 'scripts',
+                                      INDEX_SCRIPTS[index_type]),
+         '-states', states_file, '-data', data, '-output', output]
+        + list(options), cwd=ROOT, stdout=subprocess.DEVNULL)
+    return time.time() - start
+
+
+def make_states(file_name, lengths, max_length, dim=DIM, seed=0):
+    """
+    writes random encoder_out/decoder_out states (sentences x max_length
+    x dim), zero padded after the length of every sentence
+    """
+    rnd = np.random.RandomState(seed)
+    with h5py.File(file_name, 'w') as f:
+        for data in ['encoder_out', 'decoder_out']:
+            states = f.create_dataset(data, (len(lengths), max_length, dim),
+                                      dtype='float32')
+            for i, length in enumerate(lengths):
+                chunk = np.zeros((max_length, dim), dtype='float32')
+                chunk[:length] = rnd.randn(length, dim)
+                states[i] = chunk
+
+
+def make_project(directory, index_type='annoy', vocab_size=1000,
+                 sentences=200, max_length=50, seed=0):
+    """
+    writes a random project with an s2s.yaml to `directory`
+
+    :param index_type: 'annoy', 'faiss' or None (no neighbors)
+    :return: the project config
+    """
+    rnd = np.random.RandomState(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    tokens = SPECIAL_TOKENS + ['w{}'.format(i) for i in
+                               range(len(SPECIAL_TOKENS), vocab_size)]
+    for side in ['src', 'tgt']:
+        with open(os.path.join(directory, side + '.dict'), 'w') as f:
+            for iid, token in enumerate(tokens):
+                f.write('{} {}\n'.format(iid, token))
+
+    with h5py.File(os.path.join(directory, 'embs.h5'), 'w') as f:
+        for name in ['encoder', 'decoder']:
+            f.create_dataset(name, data=rnd.randn(vocab_size, DIM)
+                             .astype('float32'))
+
+    lengths = rnd.randint(5, max_length + 1, size=sentences)
+    with h5py.File(os.path.join(directory, 'train.h5'), 'w') as f:
+        for side in ['src', 'tgt']:
+            ids = np.ones((sentences, max_length), dtype='int64')  # <blank>
+            for i, length in enumerate(lengths):
+                ids[i, :length] = rnd.randint(len(SPECIAL_TOKENS),
+                                              vocab_size, size=length)
+            f.create_dataset(side, data=ids)
+
+    # the stub backend returns random states of the right shape
+    config = {'model': 'stub.pt',
+              'model_api': 'stub',
+              'model_api_options': {'dim': DIM, 'tgt_vocab_size': vocab_size},
+              'dicts': {'src': 'src.dict', 'tgt': 'tgt.dict'},
+              'embeddings': 'embs.h5',
+              'train': 'train.h5'}
+
+    if index_type:
+        states_file = os.path.join(directory, 'states.h5')
+        make_states(states_file, lengths, max_length, seed=seed)
+        config['indexType'] = index_type
+        config['indices'] = {}
+        for name in ['encoder', 'decoder']:
+            file_name = name + INDEX_EXTENSIONS[index_type]
+            build_index(index_type, states_file, name + '_out',
+                        os.path.join(directory, file_name),
+                        options=['-trees', '10']
+                        if index_type == 'annoy' else [])
+            config['indices'][name] = file_name
+
+    with open(os.path.join(directory, 's2s.yaml'), 'w') as f:
+        yaml.dump(config, f, default_flow_style=False)
+    return config
+
+
+def random_sentence(length, vocab_size=1000, seed=0):
+    rnd = np.random.RandomState(seed)
+    return ' '.join('w{}'.format(i) for i in
+                    rnd.randint(len(SPECIAL_TOKENS), vocab_size, size=length))
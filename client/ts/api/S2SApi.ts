@@ -100,6 +100,45 @@ export class S2SApi {
 
     }
 
+    static neighborDetails({vectorName, indices, half = false}) {
+        const request = Networking.ajax_request('/api/neighbor_details');
+        const payload = new Map([
+            ['vector_name', vectorName],
+            ['indices', indices.join(',')],
+            ['half', half]]);
+
+        return request
+            .get(payload)
+            .then(data => {
+                const details = JSON.parse(<string>data);
+                if (half) details.forEach(d => d.v = S2SApi.decodeHalf(d.v));
+                return details;
+            })
+    }
+
+    /**
+     * decodes a vector sent with half=true -- base64 of float16 values
+     * (little endian)
+     */
+    static decodeHalf(encoded: string): number[] {
+        const bytes = atob(encoded);
+        const res = <number[]>[];
+        for (let i = 0; i + 1 < bytes.length; i += 2) {
+            const h = bytes.charCodeAt(i) | (bytes.charCodeAt(i + 1) << 8);
+            const sign = (h & 0x8000) ? -1 : 1;
+            const exponent = (h >> 10) & 0x1f;
+            const fraction = h & 0x3ff;
+            if (exponent === 0) {
+                res.push(sign * Math.pow(2, -14) * (fraction / 1024));
+            } else if (exponent === 0x1f) {
+                res.push(fraction ? NaN : sign * Infinity);
+            } else {
+                res.push(sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024));
+            }
+        }
+        return res;
+    }
+
 }
 
 
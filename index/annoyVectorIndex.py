@@ -1,54 +1,106 @@
+import os
+
+import numpy as np
 from annoy import AnnoyIndex
 
+from index.sentenceOffsets import SentenceOffsets, encode_half, \
+    neighbor_list
+
+
+def vector_dim(file_name, sentences):
+    """
+    dimension of the vectors of an index built by scripts/h5_to_annoy.py
+    -- from the size of its `.vectors` file (float32 rows) and the
+    number of ids
+
+    :return: int or None (no vectors file or no offsets)
+    """
+    path = file_name + '.vectors'
+    if sentences.offsets is None or not os.path.exists(path):
+        return None
+    n = int(sentences.offsets[-1])
+    return os.path.getsize(path) // 4 // n if n > 0 else None
+
 
 class AnnoyVectorIndex:
 
-    def __init__(self, file_name, dim_vector=500):
-        self.u = AnnoyIndex(dim_vector)
+    def __init__(self, file_name, dim_vector=None, metric='angular',
+                 search_k=100000):
+        """
+        :param dim_vector: dimension of the vectors (default: from the
+                           files next to the index, or 500)
+        """
+        # legacy indices reserve 55 slots per sentence
+        self.sentences = SentenceOffsets.for_index(file_name, stride=55)
+        if dim_vector is None:
+            dim_vector = vector_dim(file_name, self.sentences) or 500
+        self.u = AnnoyIndex(dim_vector, metric)
+        self.search_k = search_k
         self.u.load(file_name)
 
-    def get_closest(self, ix, k=10, ignore_same_tgt=False,
-                    include_distances=False, use_vectors=False):
-        if ignore_same_tgt:
-            interval_min = ix // 55 * 55
+    def _search(self, queries, k, use_vectors=False):
+        """
+        :return: (ids, dists) -- arrays (len(queries) x k), padded with -1
+        """
+        ids = np.full((len(queries), k), -1, dtype='int64')
+        dists = np.full((len(queries), k), np.inf, dtype='float32')
+        for row, query in enumerate(queries):
             if use_vectors:
-                candidates = self.u.get_nns_by_vector(ix, k + 55,
-                                                      search_k=100000,
-                                                      include_distances=include_distances)
-            else:
-                candidates = self.u.get_nns_by_item(ix, k + 55, search_k=100000,
-                                                    include_distances=include_distances)
-            if include_distances:
-                return [k for k in zip(*candidates)
-                        if not interval_min <= k[0] <= interval_min + 55][:k]
+                r_ids, r_dists = self.u.get_nns_by_vector(
+                    query, k, search_k=self.search_k, include_distances=True)
             else:
-                return [k for k in candidates
-                        if not interval_min <= k <= interval_min + 55][:k]
-        else:
-            if use_vectors:
-                return list(
-                    zip(*self.u.get_nns_by_vector(ix, k, search_k=100000,
-                                                  include_distances=include_distances)))
+                r_ids, r_dists = self.u.get_nns_by_item(
+                    int(query), k, search_k=self.search_k,
+                    include_distances=True)
+            ids[row, :len(r_ids)] = r_ids
+            dists[row, :len(r_dists)] = r_dists
+        return ids, dists
 
-            else:
-                return list(zip(*self.u.get_nns_by_item(ix, k, search_k=100000,
-                                                        include_distances=include_distances)))
+    def get_closest(self, ix, k=10, ignore_same_tgt=False,
+                    include_distances=False, use_vectors=False,
+                    sentence=None):
+        """
+        :param ix: vector or index ID
+        :param k: number of nearest neighbors
+        :param ignore_same_tgt: ignore neighbors from the sentence of `ix`
+        :param include_distances:
+        :param use_vectors:
+        :param sentence: sentence id of a vector query (for ignore_same_tgt)
+        :return: list [(id, distance),...] or [id,...]
+        """
+        return self.get_closest_x(
+            [ix], k, ignore_same_tgt, include_distances, use_vectors,
+            sentences=None if sentence is None else [sentence])[0]
 
     def get_closest_x(self, ixs, k=10, ignore_same_tgt=False,
-                      include_distances=False, use_vectors=False):
-        res = []
-        for ix in ixs:
-            res.append(
-                self.get_closest(ix, k, ignore_same_tgt, include_distances,
-                                 use_vectors))
-        return res
+                      include_distances=False, use_vectors=False,
+                      sentences=None):
+        def search(queries, kk):
+            return self._search(queries, kk, use_vectors)
 
-    def get_details(self, ixs):
+        if ignore_same_tgt:
+            if sentences is None:
+                if use_vectors:
+                    raise ValueError('ignore_same_tgt for vector queries '
+                                     'requires their sentence ids')
+                sentences, _ = self.sentences.to_sentence(ixs)
+            ids, dists = self.sentences.search_excluding(
+                search, ixs, sentences, k, self.u.get_n_items())
+        else:
+            ids, dists = search(ixs, k)
+
+        return [neighbor_list(i, d, include_distances)
+                for i, d in zip(ids, dists)]
+
+    def get_details(self, ixs, half=False):
+        sentences, positions = self.search_to_sentence_indices(ixs)
         res = []
-        for ix in ixs:
-            res.append({'index': ix,
-                        'v': self.u.get_item_vector(ix),
-                        'pos': self.search_to_sentence_index(ix)})
+        for ix, sentence, pos in zip(ixs, sentences.tolist(),
+                                     positions.tolist()):
+            v = self.u.get_item_vector(ix)
+            if half:
+                v = encode_half(v)
+            res.append({'index': ix, 'v': v, 'pos': (sentence, pos)})
 
         return res
 
@@ -59,7 +111,11 @@ class AnnoyVectorIndex:
         return self.u.get_item_vector(ix)
 
     def search_to_sentence_index(self, index):
-        return index // 55, index % 55
+        sentence, pos = self.sentences.to_sentence(index)
+        return int(sentence), int(pos)
+
+    def search_to_sentence_indices(self, ixs):
+        return self.sentences.to_sentence(ixs)
 
     def sentence_to_search_index(self, sentence, pos_in_sent):
-        return sentence * 55 + pos_in_sent
+        return int(self.sentences.to_ids(sentence, pos_in_sent))
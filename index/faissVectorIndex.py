@@ -1,88 +1,195 @@
 import numpy as np
 import sys
+import threading
 
 # sys.path.append('faiss')
 import faiss
 
+from index.sentenceOffsets import SentenceOffsets, encode_half, \
+    neighbor_list
+
+# faiss' own defaults, restored after a per-query override
+# (faiss < 1.7.3, without SearchParameters)
+SEARCH_PARAM_DEFAULTS = {'nprobe': 1, 'efSearch': 16}
+
 
 class FaissVectorIndex:
 
-    def __init__(self, file_name, dim_vector=500, sentence_max_len=50):
+    def __init__(self, file_name, dim_vector=500, sentence_max_len=50,
+                 nprobe=None, efSearch=None):
+        """
+        :param file_name: index file written by scripts/h5_to_faiss.py
+        :param nprobe: default number of visited lists (IVF indices)
+        :param efSearch: default search depth (HNSW indices)
+        """
         self.u = faiss.read_index(file_name)  # type: faiss.Index
         self.sentence_max_length = sentence_max_len
+        self.sentences = SentenceOffsets.for_index(file_name,
+                                                   stride=sentence_max_len)
+
+        # IVF indices need a direct map to reconstruct vectors by id
+        try:
+            faiss.extract_index_ivf(self.u).make_direct_map()
+        except RuntimeError:
+            pass
+
+        self.params = faiss.ParameterSpace()
+        self.search_defaults = dict(SEARCH_PARAM_DEFAULTS)
+        self.set_search_params(nprobe=nprobe, efSearch=efSearch)
+        self.lock = threading.Lock()
+
+    def set_search_params(self, **params):
+        """
+        sets default search parameters (e.g. nprobe, efSearch) for all
+        following queries. `None` values and parameters that
+        do not apply to the index type are ignored.
+        """
+        for name, value in params.items():
+            if value is not None and self._set_param(name, value):
+                self.search_defaults[name] = value
+
+    def _set_param(self, name, value):
+        try:
+            self.params.set_index_parameter(self.u, name, value)
+            return True
+        except RuntimeError:
+            return False
+
+    def _query_params(self, nprobe=None, efSearch=None):
+        """
+        :return: faiss.SearchParameters for one search with the given
+                 overrides -- or None (defaults of the index)
+        """
+        index = self.u
+        if isinstance(index, faiss.IndexPreTransform):
+            index = faiss.downcast_index(index.index)
+        params = None
+        if nprobe is not None and \
+                faiss.try_extract_index_ivf(index) is not None:
+            params = faiss.SearchParametersIVF(nprobe=nprobe)
+        elif efSearch is not None and isinstance(index, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(efSearch=efSearch)
+        if params is not None and index is not self.u:
+            params = faiss.SearchParametersPreTransform(index_params=params)
+        return params
+
+    def _search_vectors(self, vectors, k, nprobe=None, efSearch=None):
+        if nprobe is None and efSearch is None:
+            return self.u.search(vectors, k)
+        if hasattr(faiss, 'SearchParametersIVF'):
+            # per call -- the defaults of the (shared) index stay as they are
+            params = self._query_params(nprobe, efSearch)
+            return self.u.search(vectors, k, params=params)
+
+        overrides = {name: value for name, value in
+                     (('nprobe', nprobe), ('efSearch', efSearch))
+                     if value is not None}
+        with self.lock:
+            for name, value in overrides.items():
+                self._set_param(name, value)
+            try:
+                return self.u.search(vectors, k)
+            finally:
+                for name in overrides:
+                    self._set_param(name, self.search_defaults[name])
+
+    def _search(self, queries, k, use_vectors=False, nprobe=None,
+                efSearch=None):
+        """
+        :return: (ids, dists) -- arrays (len(queries) x k), padded with -1
+        """
+        if use_vectors:
+            vectors = np.array(queries, dtype='float32')
+        else:
+            vectors = self.reconstruct(queries)
+        dists, ids = self._search_vectors(vectors, k, nprobe, efSearch)
+        return ids, dists
 
     def get_closest(self, ix, k=10, ignore_same_tgt=False,
-                    include_distances=False, use_vectors=False):
+                    include_distances=False, use_vectors=False,
+                    sentence=None, nprobe=None, efSearch=None):
         """
         :param ix: vector or index ID
         :param k: number of nearest neighbors
-        :param ignore_same_tgt:
+        :param ignore_same_tgt: ignore neighbors from the sentence of `ix`
         :param include_distances:
         :param use_vectors:
-        :return: list [(id, distance),...]
+        :param sentence: sentence id of a vector query (for ignore_same_tgt)
+        :param nprobe: overrides the default nprobe for this query
+        :param efSearch: overrides the default efSearch for this query
+        :return: list [(id, distance),...] or [id,...]
         """
+        return self.get_closest_x(
+            [ix], k, ignore_same_tgt, include_distances, use_vectors,
+            sentences=None if sentence is None else [sentence],
+            nprobe=nprobe, efSearch=efSearch)[0]
 
-        ix_conv = np.array([ix], dtype='float32')
-
-        if use_vectors:
-            candidates = self.u.search(ix_conv, k)
-            print(candidates)
-        else:
-            print('not possible')
-            candidates = []
+    def get_closest_x(self, ixs, k=10, ignore_same_tgt=False,
+                      include_distances=False, use_vectors=False,
+                      sentences=None, nprobe=None, efSearch=None):
+        def search(queries, kk):
+            return self._search(queries, kk, use_vectors, nprobe, efSearch)
 
         if ignore_same_tgt:
-            print('not possible')
-            return []
-            # interval_min = ix // 55 * 55
-            #
-            # if include_distances:
-            #     return [k for k in zip(candidates[1][0], candidates[0][0])
-            #             if not interval_min <= k[0] <= interval_min + 55][:k]
-            # else:
-            #     return [k for k in candidates[1][0]
-            #             if not interval_min <= k <= interval_min + 55][:k]
+            if sentences is None:
+                if use_vectors:
+                    raise ValueError('ignore_same_tgt for vector queries '
+                                     'requires their sentence ids')
+                sentences, _ = self.sentences.to_sentence(ixs)
+            ids, dists = self.sentences.search_excluding(
+                search, ixs, sentences, k, self.u.ntotal)
         else:
-            if include_distances:
-                return zip(candidates[1][0].tolist(), candidates[0][0].tolist())
-            else:
-                return candidates[1][0].tolist()
-
-    def get_closest_x(self, ixs, k=10, ignore_same_tgt=False,
-                      include_distances=False, use_vectors=False):
-        res = []
+            ids, dists = search(ixs, k)
 
-        ix_conv = np.array(ixs, dtype='float32')
+        return [neighbor_list(i, d, include_distances)
+                for i, d in zip(ids, dists)]
 
-        dists, inds = self.u.search(ix_conv, k)
-
-        for i in range(dists.shape[0]):
-            res.append(zip(inds[i].tolist(), dists[i].tolist()))
-
-        # for ix in ixs:
-        #     res.append(
-        #         self.get_closest(ix, k, ignore_same_tgt, include_distances,
-        #                          use_vectors))
-        return res
+    def reconstruct(self, ixs):
+        """
+        fetches the stored vectors of many ids at once
 
-    def get_details(self, ixs):
-        res = []
-        for ix in ixs:
-            res.append({'index': ix,
-                        'v': self.u.get_item_vector(ix),
-                        'pos': self.search_to_sentence_index(ix)})
+        :param ixs: list of index ids
+        :return: float32 array (len(ixs) x dim)
+        """
+        keys = np.asarray(ixs, dtype='int64')
+        if len(keys) == 0:
+            return np.zeros((0, self.u.d), dtype='float32')
+        try:
+            return self.u.reconstruct_batch(keys)
+        except (AttributeError, RuntimeError):
+            # older faiss versions or index types without batch support
+            return np.vstack([self.u.reconstruct(int(ix)) for ix in keys])
+
+    def get_details(self, ixs, half=False):
+        """
+        :param ixs: list of index ids
+        :param half: return the vectors as float16, base64 encoded
+                     (see encode_half)
+        :return: list [{index, v: vector, pos: (sentence, position)},...]
+        """
+        vectors = self.reconstruct(ixs)
+        vectors = [encode_half(v) for v in vectors] if half \
+            else vectors.tolist()
+        sentences, positions = self.search_to_sentence_indices(ixs)
 
-        return res
+        return [{'index': ix, 'v': v, 'pos': (sentence, pos)}
+                for ix, v, sentence, pos in zip(ixs, vectors,
+                                                 sentences.tolist(),
+                                                 positions.tolist())]
 
     def get_vectors(self, ixs):
-        return map(lambda x: self.u.reconstruct(x), ixs)
+        return iter(self.reconstruct(ixs))
 
     def get_vector(self, ix):
         ix_c = int(ix)
         return self.u.reconstruct(ix_c)
 
     def search_to_sentence_index(self, index):
-        return index // self.sentence_max_length, index % self.sentence_max_length
+        sentence, pos = self.sentences.to_sentence(index)
+        return int(sentence), int(pos)
+
+    def search_to_sentence_indices(self, ixs):
+        return self.sentences.to_sentence(ixs)
 
     def sentence_to_search_index(self, sentence, pos_in_sent):
-        return sentence * self.sentence_max_length + pos_in_sent
+        return int(self.sentences.to_ids(sentence, pos_in_sent))
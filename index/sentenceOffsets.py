@@ -0,0 +1,161 @@
+import base64
+import os
+
+import numpy as np
+
+
+def sentence_lengths(chunk):
+    """
+    number of real tokens per sequence -- padding rows are the
+    all-zero state vectors after the last non-zero one
+
+    :param chunk: states (seqs x slens x hid)
+    :return: int array (seqs)
+    """
+    non_pad = np.any(chunk != 0, axis=2)
+    slens = non_pad.shape[1]
+    last = slens - np.argmax(non_pad[:, ::-1], axis=1)
+    return np.where(non_pad.any(axis=1), last, 0)
+
+
+def without_padding(chunk):
+    """
+    the states in the order (and with the ids) the index scripts add them
+
+    :param chunk: states (seqs x slens x hid)
+    :return: (real token states (n x hid), sentence lengths)
+    """
+    lengths = sentence_lengths(chunk)
+    mask = np.arange(chunk.shape[1])[None, :] < lengths[:, None]
+    return chunk[mask], lengths
+
+
+def encode_half(vector):
+    """
+    compact encoding of a vector for responses -- base64 of its float16
+    (little endian) bytes, a sixth of the size of the JSON float list
+
+    :param vector: array or list of floats
+    :return: str
+    """
+    return base64.b64encode(
+        np.asarray(vector, dtype='<f2').tobytes()).decode('ascii')
+
+
+def neighbor_list(ids, dists, include_distances):
+    """
+    :param ids: array of neighbor ids, missing neighbors are -1
+    :param dists: array of distances
+    :return: [(id, distance),...] or [id,...]
+    """
+    found = ids >= 0
+    if include_distances:
+        return list(zip(ids[found].tolist(), dists[found].tolist()))
+    return ids[found].tolist()
+
+
+class SentenceOffsets:
+    """
+    Maps ids of a state index to (sentence, position in sentence) and back.
+
+    Indices built by scripts/h5_to_faiss.py and scripts/h5_to_annoy.py
+    only contain the real tokens of every sentence and store the offset
+    of each sentence (prefix sums of the sentence lengths) next to the index
+    as `<index file>.offsets.npy`. Older indices without that file
+    use a fixed number of (padded) slots per sentence.
+    """
+
+    def __init__(self, offsets=None, stride=None):
+        """
+        :param offsets: int array, first id of every sentence
+                        plus the total number of ids
+        :param stride: fixed slots per sentence if no offsets are given
+        """
+        if offsets is None and stride is None:
+            raise ValueError('either offsets or stride is required')
+        self.offsets = offsets
+        self.stride = stride
+        self._max_length = None
+
+    @classmethod
+    def for_index(cls, file_name, stride):
+        path = file_name + '.offsets.npy'
+        if os.path.exists(path):
+            return cls(offsets=np.load(path, mmap_mode='r'))
+        return cls(stride=stride)
+
+    @property
+    def max_length(self):
+        """ number of ids of the longest sentence """
+        if self._max_length is None:
+            if self.offsets is None:
+                self._max_length = self.stride
+            else:
+                self._max_length = int(np.max(np.diff(self.offsets)))
+        return self._max_length
+
+    def to_sentence(self, ids):
+        """
+        :param ids: array of index ids
+        :return: (sentence ids, positions) -- int arrays
+        """
+        ids = np.asarray(ids, dtype='int64')
+        if self.offsets is None:
+            return ids // self.stride, ids % self.stride
+
+        sentences = np.searchsorted(self.offsets, ids, side='right') - 1
+        return sentences, ids - self.offsets[sentences]
+
+    def to_ids(self, sentences, positions):
+        """
+        :param sentences: array of sentence ids
+        :param positions: array of positions within these sentences
+        :return: int array of index ids
+        """
+        sentences = np.asarray(sentences, dtype='int64')
+        positions = np.asarray(positions, dtype='int64')
+        if self.offsets is None:
+            return sentences * self.stride + positions
+        return self.offsets[sentences] + positions
+
+    def search_excluding(self, search, queries, sentences, k, max_k):
+        """
+        k nearest neighbors for every query, ignoring all results that
+        belong to the sentence of the query. Candidates are over-fetched
+        by the length of the longest sentence; queries that still lost too
+        many candidates are searched again with twice the k.
+
+        :param search: function (queries, k) -> (ids, dists), two arrays
+                       (len(queries) x k) -- missing results have id -1
+        :param queries: list of queries (vectors or ids) for `search`
+        :param sentences: sentence id of every query
+        :param k: number of nearest neighbors
+        :param max_k: largest sensible k (number of ids in the index)
+        :return: (ids, dists) -- lists with an array of <= k items per query
+        """
+        sentences = np.asarray(sentences, dtype='int64')
+        res_ids = [None] * len(queries)
+        res_dists = [None] * len(queries)
+
+        todo = np.arange(len(queries))
+        fetch = k + self.max_length
+        while len(todo) > 0:
+            fetch = min(fetch, max_k)
+            ids, dists = search([queries[q] for q in todo], fetch)
+            ids = np.asarray(ids, dtype='int64')
+            dists = np.asarray(dists)
+
+            found = ids >= 0
+            cand_sentences, _ = self.to_sentence(np.where(found, ids, 0))
+            keep = found & (cand_sentences != sentences[todo][:, None])
+
+            done = (keep.sum(axis=1) >= k) | (fetch >= max_k)
+            for row in np.nonzero(done)[0]:
+                selected = np.nonzero(keep[row])[0][:k]
+                res_ids[todo[row]] = ids[row, selected]
+                res_dists[todo[row]] = dists[row, selected]
+
+            todo = todo[~done]
+            fetch *= 2
+
+        return res_ids, res_dists
@@ -0,0 +1,148 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+
+class MicroBatcher:
+    """
+    Collects concurrent `translate` calls for up to `max_wait` seconds
+    (or `max_batch_size` sentences) and decodes compatible ones -- same k,
+    i.e. same beam size -- as one batch of the wrapped model API.
+    Requests with a partial decode or attention overwrite are decoded
+    on their own.
+
+    All calls to the wrapped model are made from a single thread,
+    so its (mutable) translator is never used concurrently. Model APIs
+    with a `submit` method (ONMTWorkerPool) are called asynchronously,
+    so batches can be decoded by several workers at once.
+    """
+
+    def __init__(self, model_api, max_batch_size=16, max_wait=0.005):
+        self.model_api = model_api
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.requests = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def translate(self, in_text, partial_decode=[], attn_overwrite=[], k=5,
+                  attn=None, roundTo=5):
+        """ same as ONMTmodelAPI.translate -- blocks until decoded """
+        if self.closed:
+            raise RuntimeError('translate on a closed MicroBatcher')
+        future = Future()
+        if partial_decode or attn_overwrite:
+            key = None
+        else:
+            key = (k, roundTo)
+        self.requests.put((key, {'in_text': in_text,
+                                 'partial_decode': partial_decode,
+                                 'attn_overwrite': attn_overwrite,
+                                 'k': k, 'roundTo': roundTo}, future))
+        return future.result()
+
+    def close(self):
+        """
+        stops the batching thread (after the requests queued so far)
+        and closes the wrapped model API
+        """
+        self.closed = True
+        self.requests.put(None)
+        self.thread.join()
+        if hasattr(self.model_api, 'close'):
+            self.model_api.close()
+        # (a project might keep the batcher -- not the model)
+        self.model_api = None
+
+    def _collect(self):
+        """ :return: next batch of requests, None once closed """
+        first = self.requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        size = len(batch[0][1]['in_text'])
+        deadline = time.time() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # stop after this batch
+                self.requests.put(None)
+                break
+            batch.append(request)
+            size += len(request[1]['in_text'])
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            groups = OrderedDict()
+            for i, (key, kwargs, future) in enumerate(batch):
+                # ungroupable requests get a key of their own
+                group_key = key if key is not None else ('single', i)
+                groups.setdefault(group_key, []).append((kwargs, future))
+
+            for items in groups.values():
+                self._run(items)
+
+    def _submit(self, **kwargs):
+        """
+        decodes asynchronously if the model API supports it
+        (e.g. ONMTWorkerPool), otherwise right away
+        """
+        if hasattr(self.model_api, 'submit'):
+            return self.model_api.submit(**kwargs)
+
+        future = Future()
+        try:
+            future.set_result(self.model_api.translate(**kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _run(self, items):
+        if len(items) == 1:
+            kwargs, future = items[0]
+            self._submit(**kwargs).add_done_callback(
+                lambda done: _forward(done, future))
+            return
+
+        in_text = []
+        for kwargs, _ in items:
+            in_text.extend(kwargs['in_text'])
+
+        def split(done):
+            # split the batch reply back into one reply per request
+            if done.exception() is not None:
+                for _, future in items:
+                    future.set_exception(done.exception())
+                return
+            reply = done.result()
+            offset = 0
+            for kwargs, future in items:
+                n = len(kwargs['in_text'])
+                future.set_result({i: reply[offset + i] for i in range(n)})
+                offset += n
+
+        self._submit(in_text=in_text, k=items[0][0]['k'],
+                     roundTo=items[0][0]['roundTo']).add_done_callback(split)
+
+
+def _forward(done, future):
+    if done.exception() is not None:
+        future.set_exception(done.exception())
+    else:
+        future.set_result(done.result())
@@ -1,6 +1,12 @@
+import asyncio
+import functools
 import json
-import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 from model_api.abstract_model_api import AbstractModelAPI
 
@@ -8,28 +14,93 @@ __author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
 
 
 class ONMTLuaModelAPI(AbstractModelAPI):
-    def __init__(self, url: str = "http://127.0.0.1:7784/translator/translate"):
+    """
+    Client of the OpenNMT (lua) translation server. Requests go over a
+    pooled keep-alive session; all sentences of a call are sent in one
+    POST. `translate_async` runs translations on a thread pool for asyncio
+    code. scripts/lua_stub_server.py answers like the translation server
+    for local tests.
+    """
+
+    def __init__(self, url: str = "http://127.0.0.1:7784/translator/translate",
+                 pool_size: int = 10, timeout=(3.05, 60), retries: int = 2):
+        """
+        :param pool_size: max. number of open connections (and of
+                          translate_async calls in flight)
+        :param timeout: seconds -- (connect, read) or one value for both
+        :param retries: retries of failed connection attempts
+        """
         self.url = url
+        self.timeout = tuple(timeout) if isinstance(timeout, list) \
+            else timeout
+        self.pool_size = pool_size
 
-    def translate(self, in_text: str, partial_decode: str = None, k: int = 1, attn: dict = None):
+        self.session = requests.Session()
+        # only connecting is retried -- a translation might have started
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=Retry(total=retries,
+                                                connect=retries,
+                                                read=0, status=0,
+                                                backoff_factor=0.1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = None
+
+    def translate(self, in_text, partial_decode=[], attn_overwrite=[], k=1,
+                  attn=None, roundTo=5):
+        """
+        :param in_text: list of sentences
+        :return: dict: index of the sentence -> translation
+        """
         if k > 1:
             logging.warning('This version of the API only supports top 1 prediction. Sorry..')
 
         if partial_decode:
             logging.warning('This version of the API does not support partial decode.. ')
 
-        response = requests.post(self.url, data=json.dumps([{"src": in_text}]))
+        return self.translate_batch(in_text, roundTo=roundTo)
+
+    def translate_batch(self, in_text, roundTo=5):
+        """
+        translates all sentences of `in_text` with one request
+
+        :return: dict: index of the sentence -> translation
+        """
+        response = self.session.post(
+            self.url, data=json.dumps([{"src": src} for src in in_text]),
+            timeout=self.timeout)
+        response.raise_for_status()
 
         # response: [[{'src': 'Hello World', 'tgt': 'Hallo Welt', 'pred_score': -0.1768690943718, 'attn': [[0.62342292070389,
-        # 0.37657704949379], [0.16017833352089, 0.83982169628143]], 'n_best': 1}]]
+        # 0.37657704949379], [0.16017833352089, 0.83982169628143]], 'n_best': 1}], ...] -- n_best per sentence
+
+        reply = {}
+        for transIx, n_best in enumerate(response.json()):
+            r = n_best[0]
+            reply[transIx] = {
+                'encoder': list(map(lambda x: {'token': x}, r['src'].split())),
+                'decoder': [list(map(lambda x: {'token': x},
+                                     r['tgt'].split()))],
+                'attn': [[[round(a, roundTo) for a in row]
+                          for row in r['attn']]],
+                'scores': [r.get('pred_score')],
+                'beam': [],
+                'beam_trace': []
+            }
+        return reply
 
-        r = response.json()[0][0]
+    async def translate_async(self, in_text, **kwargs):
+        """ `translate` for asyncio -- runs on a pool of `pool_size` threads """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.pool_size)
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(self.translate, in_text,
+                                             **kwargs))
 
-        return {
-            'encoder': list(map(lambda x: {'token': x}, r['src'].split())),
-            'decoder': [list(map(lambda x: {'token': x}, r['tgt'].split()))],
-            'attn': [list(r['attn'])]
-        }
+    def close(self):
+        self.session.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
 
     def n_closest_tokens(self, token: str, n: int = 10):
         pass
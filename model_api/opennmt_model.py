@@ -3,6 +3,8 @@ from __future__ import division, unicode_literals
 
 import argparse
 import io
+import threading
+import time
 from itertools import chain
 
 import h5py
@@ -15,6 +17,9 @@ import onmt.translate
 import torch
 from onmt.io import TextDataset
 
+from model_api.state_cache import CachedEncoder, CachedPrefixDecoder
+from s2s.metrics import metrics
+
 PAD_WORD = '<blank>'
 UNK = 0
 BOS_WORD = '<s>'
@@ -202,8 +207,28 @@ def model_opts(parser):
                        help='Lambda value for coverage.')
 
 
+def use_weights(model, weights):
+    """
+    points the parameters and buffers of `model` to the tensors of
+    `weights` (name -> tensor) -- without copying them, so several
+    processes can use one copy in shared memory
+    """
+    params = model.state_dict(keep_vars=True)
+    missing = [name for name in params if name not in weights]
+    if missing:
+        raise ValueError('weights without ' + ', '.join(missing))
+    for name, param in params.items():
+        param.data = weights[name]
+
+
 class ONMTmodelAPI():
-    def __init__(self, model_loc, gpu=-1, beam_size=5, k=5):
+    def __init__(self, model_loc, gpu=-1, beam_size=5, k=5,
+                 encoder_cache=20, prefix_cache=100, shared_weights=None):
+        """
+        :param shared_weights: name -> tensor, weights to use instead of
+                               the ones of the model file (see
+                               worker_pool.load_shared_weights)
+        """
         # Simulate all commandline args
         parser = argparse.ArgumentParser(
             description='translate.py',
@@ -223,6 +248,18 @@ class ONMTmodelAPI():
         self.fields, self.model, self.model_opt = \
             onmt.ModelConstructor.load_test_model(
                 self.opt, self.dummy_opt.__dict__)
+        if shared_weights is not None:
+            # the weights just loaded are freed
+            use_weights(self.model, shared_weights)
+
+        # Keep encoder results of the last sources (0 = no caching)
+        if encoder_cache > 0:
+            self.model.encoder = CachedEncoder(self.model.encoder,
+                                               size=encoder_cache)
+        # Keep decoder steps of forced prefixes (0 = no caching)
+        if prefix_cache > 0:
+            self.model.decoder = CachedPrefixDecoder(self.model.decoder,
+                                                     size=prefix_cache)
 
         # Make GPU decoding possible
         self.opt.gpu = gpu
@@ -243,16 +280,28 @@ class ONMTmodelAPI():
             copy_attn=self.model_opt.copy_attn,
             cuda=self.opt.cuda,
             beam_trace=self.opt.dump_beam != "")
+        self.lock = threading.Lock()
 
     def translate(self, in_text, partial_decode=[], attn_overwrite=[], k=5,
-                  attn=None, dump_data=False, roundTo=5):
+                  attn=None, dump_data=False, roundTo=5, arrays=False):
         """
         in_text: list of strings
         partial_decode: list of strings, not implemented yet
         k: int, number of top translations to return
         attn: list, not implemented yet
+        arrays: bool, return states and attention as float32 numpy arrays
+                instead of rounded lists (compact to send between processes)
+
+        Calls from several threads run one after the other -- the options
+        (batch size, n_best) and the keys of the state caches are set
+        on the shared translator for every call.
         """
+        with self.lock:
+            return self._translate(in_text, partial_decode, attn_overwrite,
+                                   k, attn, dump_data, roundTo, arrays)
 
+    def _translate(self, in_text, partial_decode, attn_overwrite, k, attn,
+                   dump_data, roundTo, arrays):
         # Set batch size to number of requested translations
         self.opt.batch_size = len(in_text)
         # Workaround until we have API that does not require files
@@ -332,21 +381,47 @@ class ONMTmodelAPI():
         # Only has one batch, but indexing does not work
         for batch in test_data:
             print(attn_overwrite, 'over')
-            batch_data = self.translator.translate_batch(
-                batch, data, return_states=True,
-                partial=partial, attn_overwrite=attn_overwrite)
+            # only single sentences are cached -- batches of several
+            # (MicroBatcher) would fill the caches with one-off entries
+            cacheable = len(in_text) == 1
+            if cacheable and isinstance(self.model.encoder, CachedEncoder):
+                self.model.encoder.key = in_text[0]
+            if cacheable and partial and isinstance(self.model.decoder,
+                                                    CachedPrefixDecoder):
+                self.model.decoder.start(
+                    key=(in_text[0], repr(attn_overwrite)),
+                    steps=max(len(p) for p in partial) + 1)
+            try:
+                # includes the encoder (see CachedEncoder)
+                with metrics.span('beam_search'):
+                    batch_data = self.translator.translate_batch(
+                        batch, data, return_states=True,
+                        partial=partial, attn_overwrite=attn_overwrite)
+            finally:
+                if isinstance(self.model.encoder, CachedEncoder):
+                    self.model.encoder.key = None
+                if isinstance(self.model.decoder, CachedPrefixDecoder):
+                    self.model.decoder.stop()
+            extract_start = time.time()
             translations = builder.from_batch(batch_data)
+            # translations come in input order, but the batch itself
+            # (and all returned states) is sorted by source length
+            batch_pos = {orig: b for b, orig in
+                         enumerate(batch.indices.data.tolist())}
             # iteratres over items in batch
-            rr = lambda x: [(round(xx, roundTo)) for xx in x]
+            rr = lambda x: [(round(xx, roundTo)) for xx in x.tolist()]
+            if arrays:
+                rr = lambda x: np.array(x, dtype='float32')
             for transIx, trans in enumerate(translations):
-                context = batch_data['context'][:, transIx, :]
+                bIx = batch_pos[transIx]
+                context = batch_data['context'][:, bIx, :]
                 print(trans.pred_sents)
                 res = {}
                 # Fill encoder Result
                 encoderRes = []
                 for token, state in zip(in_text[transIx].split(), context):
                     encoderRes.append({'token': token,
-                                       'state': rr(list(state.data))
+                                       'state': rr(state.data.cpu().numpy())
                                        })
                 res['encoder'] = encoderRes
 
@@ -361,16 +436,16 @@ class ONMTmodelAPI():
                                                              trans.attns[ix],
                                                              batch_data[
                                                                  "target_states"][
-                                                                 transIx][ix],
+                                                                 bIx][ix],
                                                              batch_data[
                                                                  'target_cstar'][
-                                                                 transIx][ix]):
+                                                                 bIx][ix]):
                             currentDec = {}
                             currentDec['token'] = token
-                            currentDec['state'] = rr(list(state.data))
-                            currentDec['cstar'] = rr(list(cstar.data))
+                            currentDec['state'] = rr(state.data.cpu().numpy())
+                            currentDec['cstar'] = rr(cstar.data.cpu().numpy())
                             topIx.append(currentDec)
-                            topIxAttn.append(rr(list(attn)))
+                            topIxAttn.append(rr(attn.cpu().numpy()))
                             # if t in ['.', '!', '?']:
                             #     break
                         decoderRes.append(topIx)
@@ -383,16 +458,17 @@ class ONMTmodelAPI():
                 convert_to_py = lambda x: {"pred": x['pred'].item(),
                                            "score": x[
                                                'score'].item(),
-                                           "state": rr(
+                                           "state": rr(np.array(
                                                list(map(lambda s: s.item(),
-                                                        x['state'])))
+                                                        x['state']))))
                                            }
                 res['beam'] = list(map(lambda t:
                                        list(map(convert_to_py,
                                                 t)),
-                                       batch_data['beam'][transIx]))
-                res['beam_trace'] = batch_data['beam_trace'][transIx]
+                                       batch_data['beam'][bIx]))
+                res['beam_trace'] = batch_data['beam_trace'][bIx]
                 reply[transIx] = res
+            metrics.observe('extract', time.time() - extract_start)
         return reply
 
     @staticmethod
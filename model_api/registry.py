@@ -0,0 +1,44 @@
+from collections import namedtuple
+
+from s2s.lazy import lazy_import
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+# module and class of a backend; `model_file`: the class takes the model
+# file of the project as first argument
+Backend = namedtuple('Backend', ['module', 'name', 'model_file'])
+
+# backends are imported on first use -- only the pytorch and workers
+# backends need torch and onmt. 'workers' runs the model in local worker
+# processes, 'remote' sends requests to scripts/model_worker_server.py
+# on other machines.
+BACKENDS = {
+    'pytorch': Backend('model_api.opennmt_model', 'ONMTmodelAPI', True),
+    'workers': Backend('model_api.worker_pool', 'ONMTWorkerPool', True),
+    'remote': Backend('model_api.remote_model_api', 'RemoteModelAPI', False),
+    'lua': Backend('model_api.onmt_lua_model_api', 'ONMTLuaModelAPI', False),
+    'stub': Backend('model_api.stub_model_api', 'StubModelAPI', False),
+}
+
+
+def register_backend(name, module, class_name, model_file=True):
+    """ makes another model API selectable as `model_api: <name>` """
+    BACKENDS[name] = Backend(module, class_name, model_file)
+
+
+def create_model_api(name, model_loc, **options):
+    """
+    :param name: backend name (see BACKENDS)
+    :param model_loc: model file of the project
+    :param options: keyword arguments for the backend class
+                    (`model_api_options` in s2s.yaml)
+    :return: the model API
+    """
+    if name not in BACKENDS:
+        raise ValueError('unknown model_api: {} (choose from {})'.format(
+            name, ', '.join(sorted(BACKENDS))))
+    backend = BACKENDS[name]
+    cls = getattr(lazy_import(backend.module), backend.name)
+    if backend.model_file:
+        return cls(model_loc, **options)
+    return cls(**options)
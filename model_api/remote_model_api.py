@@ -0,0 +1,90 @@
+import json
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from model_api.abstract_model_api import AbstractModelAPI
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+
+class RemoteModelAPI(AbstractModelAPI):
+    """
+    Client of model workers on other machines (`model_api: remote`).
+    Every worker runs scripts/model_worker_server.py with a model
+    backend of its own and answers the full ONMTmodelAPI.translate
+    (states, beam, partial decode, attention overwrite). A call goes to
+    the worker with the fewest requests in flight; if it cannot be
+    reached, the next one is tried.
+    """
+
+    def __init__(self, urls=("http://127.0.0.1:7785/translate",),
+                 pool_size: int = 10, timeout=(3.05, 120), retries: int = 1):
+        """
+        :param urls: translation endpoints of the workers
+        :param pool_size: max. number of open connections per worker
+        :param timeout: seconds -- (connect, read) or one value for both
+        :param retries: retries of failed connection attempts per worker
+        """
+        self.urls = [urls] if isinstance(urls, str) else list(urls)
+        if not self.urls:
+            raise ValueError('remote model API needs at least one url')
+        self.timeout = tuple(timeout) if isinstance(timeout, list) \
+            else timeout
+
+        self.session = requests.Session()
+        # only connecting is retried -- a translation might have started
+        adapter = HTTPAdapter(pool_connections=len(self.urls),
+                              pool_maxsize=pool_size,
+                              max_retries=Retry(total=retries,
+                                                connect=retries,
+                                                read=0, status=0,
+                                                backoff_factor=0.1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.in_flight = {url: 0 for url in self.urls}
+        self.lock = threading.Lock()
+
+    def _by_load(self):
+        with self.lock:
+            return sorted(self.urls, key=lambda url: self.in_flight[url])
+
+    def translate(self, in_text, partial_decode=[], attn_overwrite=[], k=5,
+                  attn=None, roundTo=5):
+        """
+        :param in_text: list of sentences
+        :return: dict: index of the sentence -> translation
+        """
+        data = json.dumps({'in_text': in_text,
+                           'partial_decode': partial_decode,
+                           'attn_overwrite': attn_overwrite,
+                           'k': k, 'roundTo': roundTo})
+        error = None
+        for url in self._by_load():
+            with self.lock:
+                self.in_flight[url] += 1
+            try:
+                response = self.session.post(
+                    url, data=data, timeout=self.timeout,
+                    headers={'Content-Type': 'application/json'})
+            except requests.ConnectionError as e:
+                logging.warning('model worker %s unreachable: %s', url, e)
+                error = e
+                continue
+            finally:
+                with self.lock:
+                    self.in_flight[url] -= 1
+            response.raise_for_status()
+            # JSON object keys are strings
+            return {int(transIx): translation for transIx, translation
+                    in response.json().items()}
+        raise error
+
+    def close(self):
+        self.session.close()
+
+    def n_closest_tokens(self, token: str, n: int = 10):
+        pass
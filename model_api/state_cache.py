@@ -0,0 +1,118 @@
+import copy
+
+import torch.nn as nn
+
+from s2s.lru import LRU
+from s2s.metrics import metrics
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+
+class CachedEncoder(nn.Module):
+    """
+    Wraps the encoder of an onmt model and keeps its outputs (final hidden
+    state and context) for the last `size` source inputs. The translator
+    calls the encoder as usual; ONMTmodelAPI sets `key` to the source
+    sentence before decoding a single sentence, so re-translations of the
+    same source with another partial decode or attention overwrite
+    only redo the decoding. Calls without a key (batches of several
+    sentences) are not cached. `key` is shared by all callers -- the
+    model API serializes its translations.
+    """
+
+    def __init__(self, encoder, size=20):
+        super(CachedEncoder, self).__init__()
+        self.encoder = encoder
+        self.cache = LRU(size)
+        self.key = None
+
+    def forward(self, src, lengths=None, *args, **kwargs):
+        if self.key is None:
+            with metrics.span('encoder'):
+                return self.encoder(src, lengths, *args, **kwargs)
+
+        out = self.cache.get(self.key)
+        if out is None:
+            with metrics.span('encoder'):
+                out = self.encoder(src, lengths, *args, **kwargs)
+            self.cache.add(self.key, out)
+        return out
+
+    def __getattr__(self, name):
+        try:
+            return super(CachedEncoder, self).__getattr__(name)
+        except AttributeError:
+            # everything else (embeddings, ...) comes from the encoder
+            encoder = super(CachedEncoder, self).__getattr__('encoder')
+            return getattr(encoder, name)
+
+
+def clone_state(state):
+    """
+    copies an onmt decoder state -- the translator updates
+    decoder states in place (beam_update), cached ones must not change
+    """
+    clone = copy.copy(state)
+    for name, value in vars(state).items():
+        if isinstance(value, tuple):
+            setattr(clone, name, tuple(v.clone() for v in value))
+        elif hasattr(value, 'clone'):
+            setattr(clone, name, value.clone())
+    return clone
+
+
+class CachedPrefixDecoder(nn.Module):
+    """
+    Wraps the decoder of an onmt model and keeps its outputs and states
+    while the translator is forced through a partial decode (prefix).
+    Each step is keyed by the source, the attention overwrite and all
+    decoder inputs so far, so a request whose prefix extends an earlier
+    one replays the cached steps and only runs the decoder for the new
+    tokens. ONMTmodelAPI calls `start` before and `stop` after decoding
+    (and serializes its translations, `key` and `history` are shared).
+    """
+
+    def __init__(self, decoder, size=100):
+        super(CachedPrefixDecoder, self).__init__()
+        self.decoder = decoder
+        self.cache = LRU(size)
+        self.key = None
+        self.steps = 0
+        self.history = ()
+
+    def start(self, key, steps):
+        """
+        :param key: source and attention overwrite of the batch
+        :param steps: number of decoder steps to cache (prefix length + 1)
+        """
+        self.key = key
+        self.steps = steps
+        self.history = ()
+
+    def stop(self):
+        self.key = None
+        self.history = ()
+
+    def forward(self, tgt, context, state, *args, **kwargs):
+        if self.key is None or len(self.history) >= self.steps:
+            return self.decoder(tgt, context, state, *args, **kwargs)
+
+        self.history += (tuple(tgt.data.view(-1).tolist()),)
+        step_key = (self.key, self.history)
+        hit = self.cache.get(step_key)
+        if hit is not None:
+            dec_out, dec_state, attn = hit
+            return dec_out, clone_state(dec_state), attn
+
+        dec_out, dec_state, attn = self.decoder(tgt, context, state,
+                                                *args, **kwargs)
+        self.cache.add(step_key, (dec_out, clone_state(dec_state), attn))
+        return dec_out, dec_state, attn
+
+    def __getattr__(self, name):
+        try:
+            return super(CachedPrefixDecoder, self).__getattr__(name)
+        except AttributeError:
+            # init_decoder_state, embeddings, ... come from the decoder
+            decoder = super(CachedPrefixDecoder, self).__getattr__('decoder')
+            return getattr(decoder, name)
@@ -0,0 +1,69 @@
+import zlib
+
+import numpy as np
+
+from model_api.abstract_model_api import AbstractModelAPI
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+
+class StubModelAPI(AbstractModelAPI):
+    """
+    Stands in for ONMTmodelAPI without torch or a trained model
+    (`model_api: stub`): returns random (but per sentence deterministic)
+    replies of the same structure and shape -- states of `dim` floats,
+    k beams, attention over the source -- so everything after the model
+    can be benchmarked or tested offline.
+    """
+
+    def __init__(self, dim=500, tgt_vocab_size=1000, tgt_length=None,
+                 i2t=None):
+        """
+        :param tgt_length: length of the translations (default: length
+                           of the source sentence)
+        :param i2t: target dictionary id -> token for the decoder tokens
+                    (default: w<id>)
+        """
+        self.dim = dim
+        self.tgt_vocab_size = tgt_vocab_size
+        self.tgt_length = tgt_length
+        self.i2t = i2t or {}
+
+    def translate(self, in_text, partial_decode=[], attn_overwrite=[], k=5,
+                  attn=None, roundTo=5):
+        rr = lambda x: [round(xx, roundTo) for xx in x.tolist()]
+        reply = {}
+        for transIx, sentence in enumerate(in_text):
+            rnd = np.random.RandomState(
+                zlib.crc32((sentence + repr(partial_decode)).encode('utf-8')))
+            src = sentence.split()
+            tgt_length = self.tgt_length or len(src)
+
+            encoder = rnd.randn(len(src), self.dim).astype('float32')
+            preds = rnd.randint(4, self.tgt_vocab_size, size=(k, tgt_length))
+
+            res = {'encoder': [{'token': token, 'state': rr(state)}
+                               for token, state in zip(src, encoder)]}
+            res['decoder'] = []
+            res['attn'] = []
+            for top in range(k):
+                states = rnd.randn(tgt_length, self.dim).astype('float32')
+                cstars = rnd.randn(tgt_length, self.dim).astype('float32')
+                attn_top = rnd.dirichlet(np.ones(len(src)), size=tgt_length)
+                res['decoder'].append([
+                    {'token': self.i2t.get(int(pred), 'w{}'.format(pred)),
+                     'state': rr(state), 'cstar': rr(cstar)}
+                    for pred, state, cstar in
+                    zip(preds[top], states, cstars)])
+                res['attn'].append([rr(a) for a in attn_top])
+            res['scores'] = sorted(rnd.randn(k).tolist(), reverse=True)
+            res['beam'] = [[{'pred': int(preds[top, step]),
+                             'score': float(rnd.randn()),
+                             'state': rr(rnd.randn(k))}
+                            for top in range(k)]
+                           for step in range(tgt_length)]
+            res['beam_trace'] = [[preds[top, :step + 1].tolist()
+                                  for top in range(k)]
+                                 for step in range(tgt_length)]
+            reply[transIx] = res
+        return reply
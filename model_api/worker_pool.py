@@ -0,0 +1,205 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import numpy as np
+import torch
+# (registers the reductions that pass shared tensors as handles)
+import torch.multiprocessing
+
+from model_api.opennmt_model import ONMTmodelAPI
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+
+def load_shared_weights(model_loc):
+    """
+    loads the weights of a model file into shared memory -- spawned
+    workers get handles to them, not copies
+
+    :return: dict: parameter name (of the model incl. its generator)
+             -> tensor
+    """
+    try:
+        checkpoint = torch.load(model_loc, map_location='cpu',
+                                weights_only=False)
+    except TypeError:
+        # torch < 1.13
+        checkpoint = torch.load(
+            model_loc, map_location=lambda storage, loc: storage)
+    weights = dict(checkpoint['model'])
+    weights.update(('generator.' + name, tensor)
+                   for name, tensor in checkpoint['generator'].items())
+    for tensor in weights.values():
+        tensor.share_memory_()
+    return weights
+
+
+def _worker(model_loc, model_kwargs, tasks, results, threads):
+    torch.set_num_threads(threads)
+    model_api = ONMTmodelAPI(model_loc, **model_kwargs)
+    while True:
+        job = tasks.get()
+        if job is None:
+            break
+        job_id, kwargs = job
+        try:
+            reply = model_api.translate(arrays=True, **kwargs)
+            results.put((job_id, reply, None))
+        except Exception as e:
+            # exceptions of torch/onmt are not guaranteed to pickle
+            results.put((job_id, None, repr(e)))
+
+
+def arrays_to_lists(reply, roundTo=5):
+    """
+    converts a reply of ONMTmodelAPI.translate(arrays=True)
+    into the regular reply with rounded lists
+    """
+    rr = lambda x: np.round(x, roundTo).tolist()
+    for res in reply.values():
+        for enc in res['encoder']:
+            enc['state'] = rr(enc['state'])
+        for top in res['decoder']:
+            for dec in top:
+                dec['state'] = rr(dec['state'])
+                dec['cstar'] = rr(dec['cstar'])
+        res['attn'] = [[rr(a) for a in top] for top in res['attn']]
+        for level in res['beam']:
+            for b in level:
+                b['state'] = rr(b['state'])
+    return reply
+
+
+class ONMTWorkerPool:
+    """
+    Runs `workers` replicas of ONMTmodelAPI in separate processes on this
+    machine, so `translate` can be called from many threads at once
+    (model_api.remote_model_api serves workers on other machines).
+
+    Workers are started with 'spawn' -- forking the multi-threaded server
+    could copy held (import, logging, OpenMP) locks into the children.
+    With `share_weights` (CPU only), the weights are loaded once into
+    shared memory and all workers use them, so N workers cost about one
+    model plus N translators instead of N models (each worker briefly
+    holds its own copy while it starts). A worker that dies
+    (crash, OOM kill) fails its pending requests and is restarted;
+    `translate` gives up after `timeout` seconds.
+    """
+
+    def __init__(self, model_loc, workers=2, threads_per_worker=1,
+                 timeout=120, share_weights=True, **kwargs):
+        self.model_loc = model_loc
+        self.model_kwargs = kwargs
+        self.threads_per_worker = threads_per_worker
+        self.timeout = timeout
+        if share_weights and kwargs.get('gpu', -1) < 0:
+            # kept alive here for the workers (and their restarts)
+            kwargs['shared_weights'] = load_shared_weights(model_loc)
+
+        self.ctx = torch.multiprocessing.get_context('spawn')
+        self.results = self.ctx.Queue()
+        self.job_ids = itertools.count()
+        self.pending = {}  # job id -> (future, roundTo, worker)
+        self.lock = threading.Lock()
+        self.closed = False
+        self.workers = [self._start_worker() for _ in range(workers)]
+
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+        logging.info('started %d translation workers', workers)
+
+    def _start_worker(self):
+        tasks = self.ctx.Queue()
+        process = self.ctx.Process(
+            target=_worker,
+            args=(self.model_loc, self.model_kwargs, tasks, self.results,
+                  self.threads_per_worker),
+            daemon=True)
+        process.start()
+        return {'process': process, 'tasks': tasks, 'jobs': set()}
+
+    def _collect(self):
+        last_check = time.time()
+        while not self.closed:
+            try:
+                job_id, reply, error = self.results.get(timeout=1)
+            except queue.Empty:
+                job_id = None
+            if time.time() - last_check >= 1:
+                self._check_workers()
+                last_check = time.time()
+            if job_id is None:
+                continue
+
+            with self.lock:
+                entry = self.pending.pop(job_id, None)
+                if entry is not None:
+                    entry[2]['jobs'].discard(job_id)
+            if entry is None:
+                # timed out or its worker was declared dead
+                continue
+            future, roundTo, _ = entry
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(arrays_to_lists(reply, roundTo))
+
+    def _check_workers(self):
+        failed = []
+        with self.lock:
+            for i, worker in enumerate(self.workers):
+                if self.closed or worker['process'].is_alive():
+                    continue
+                logging.error('translation worker died (exit code %s), '
+                              'restarting it', worker['process'].exitcode)
+                failed += [self.pending.pop(job_id)[0]
+                           for job_id in worker['jobs']
+                           if job_id in self.pending]
+                self.workers[i] = self._start_worker()
+        for future in failed:
+            future.set_exception(RuntimeError('translation worker died'))
+
+    def submit(self, in_text, partial_decode=[], attn_overwrite=[], k=5,
+               roundTo=5):
+        """
+        same parameters as ONMTmodelAPI.translate
+
+        :return: Future of the translation reply
+        """
+        future = Future()
+        future.job_id = next(self.job_ids)
+        with self.lock:
+            worker = min(self.workers, key=lambda w: len(w['jobs']))
+            worker['jobs'].add(future.job_id)
+            self.pending[future.job_id] = future, roundTo, worker
+        worker['tasks'].put((future.job_id, {'in_text': in_text,
+                                             'partial_decode': partial_decode,
+                                             'attn_overwrite': attn_overwrite,
+                                             'k': k}))
+        return future
+
+    def translate(self, in_text, partial_decode=[], attn_overwrite=[], k=5,
+                  attn=None, roundTo=5):
+        future = self.submit(in_text, partial_decode, attn_overwrite, k,
+                             roundTo)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self.lock:
+                entry = self.pending.pop(future.job_id, None)
+                if entry is not None:
+                    entry[2]['jobs'].discard(future.job_id)
+            raise
+
+    def close(self):
+        self.closed = True
+        for worker in self.workers:
+            worker['tasks'].put(None)
+        for worker in self.workers:
+            worker['process'].join(timeout=10)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
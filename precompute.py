@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Batch-translates a file of sentences (one per line) and writes every
+response in the format of the `--cache` directory of server.py, e.g.:
+
+    python3 precompute.py --dir data/ --sentences test_sentences.txt \
+        --output cache/ --neighbors encoder decoder --workers 4 --batch_size 16
+
+The sentences are translated by every project of --dir (or only by
+the ones given with --project_id). Sentences that already have a
+response in the output directory are skipped, so an interrupted run
+can simply be started again.
+"""
+import argparse
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import json
+from tqdm import tqdm
+
+# loads all projects of --dir with the model options (--workers,
+# --batch_size, ...) of the server
+import server
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+parser = argparse.ArgumentParser(
+    description='precompute responses for the server cache',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--sentences", type=str, required=True,
+                    help="File with one input sentence per line")
+parser.add_argument("--output", type=str, required=True,
+                    help="Cache directory to write the responses to")
+parser.add_argument("--neighbors", type=str, nargs='*', default=[],
+                    help="Neighborhoods to compute (encoder, decoder, "
+                         "context)")
+parser.add_argument("--project_id", type=str, nargs='*', default=[],
+                    help="Projects to precompute (default: all)")
+parser.add_argument("--threads", type=int, default=0,
+                    help="Number of requests in flight at once (default: 8 "
+                         "with --workers or --batch_size, 1 otherwise)")
+
+
+def response_file(directory, request):
+    digest = hashlib.sha1(
+        server.translation_key(request).encode('utf-8')).hexdigest()
+    return os.path.join(directory, digest + '.json')
+
+
+def precompute(request, file):
+    res = server.get_translation(**request)
+    tmp = file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(res, f)
+    os.replace(tmp, file)
+
+
+def main():
+    opt, _ = parser.parse_known_args()
+    if opt.threads <= 0:
+        # one model in the server process translates one request at a time
+        parallel = server.args.workers > 0 or server.args.batch_size > 1
+        opt.threads = 8 if parallel else 1
+    os.makedirs(opt.output, exist_ok=True)
+
+    with open(opt.sentences, 'r') as f:
+        sentences = [line.strip() for line in f if len(line.strip()) > 0]
+
+    project_ids = opt.project_id or server.projects.ids()
+    unknown = set(project_ids) - set(server.projects.ids())
+    if unknown:
+        parser.error('unknown project ids: ' + ', '.join(sorted(unknown)))
+
+    requests = [{'in': sentence, 'neighbors': opt.neighbors or [''],
+                 'project_id': project_id}
+                for project_id in project_ids for sentence in sentences]
+    todo = [(r, response_file(opt.output, r)) for r in requests]
+    todo = [(r, file) for r, file in todo if not os.path.exists(file)]
+    print("{} of {} sentences left to compute ({} projects)".format(
+        len(todo), len(requests), len(project_ids)))
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=opt.threads) as executor:
+        futures = {executor.submit(precompute, r, file): r
+                   for r, file in todo}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                future.result()
+            except Exception:
+                failed += 1
+                logging.exception('failed: %s (%s)', futures[future]['in'],
+                                  futures[future]['project_id'])
+
+    if failed:
+        print("{} sentences failed -- run again to retry".format(failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+
+MANIFEST_FILE_NAME = '.manifest.json'
+TAIL_BYTES = 1 << 16
+
+
+def read_request(path):
+    """
+    reads the `request` entry of a cached response without parsing the
+    whole file -- responses are written with `request` as last key, so
+    it is looked up in the tail of the file first
+
+    :param path: json file of a cached response
+    :return: the request dict
+    """
+    with open(path, 'r') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - TAIL_BYTES))
+        tail = f.read()
+
+    decoder = json.JSONDecoder()
+    pos = tail.rfind('"request"')
+    if pos >= 0:
+        try:
+            start = tail.index(':', pos) + 1
+            while tail[start].isspace():
+                start += 1
+            request, _ = decoder.raw_decode(tail, start)
+            if isinstance(request, dict) and 'in' in request:
+                return request
+        except (ValueError, IndexError):
+            pass
+
+    with open(path, 'r') as f:
+        return json.load(f)['request']
+
+
+def load_manifest(directory):
+    """
+    indexes all cached responses (.json files) of a directory by their
+    request. The index is kept in a manifest file in that directory and
+    only files that are new or changed since are read again.
+
+    :param directory: cache directory
+    :return: dict {file path: request}
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILE_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except ValueError:
+            logging.warning('rebuilding broken cache manifest')
+
+    updated = {}
+    changed = False
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith('.json') or name == MANIFEST_FILE_NAME \
+                or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entry = manifest.get(name)
+        if not entry or entry['mtime'] != stat.st_mtime \
+                or entry['size'] != stat.st_size:
+            entry = {'mtime': stat.st_mtime, 'size': stat.st_size,
+                     'request': read_request(path)}
+            changed = True
+        updated[name] = entry
+
+    if changed or len(updated) != len(manifest):
+        try:
+            with open(manifest_path, 'w') as f:
+                json.dump(updated, f)
+        except OSError as e:
+            logging.info('cache manifest not written: %s', e)
+
+    return {os.path.join(directory, name): entry['request']
+            for name, entry in updated.items()}
@@ -0,0 +1,126 @@
+import atexit
+import hashlib
+import logging
+import os
+import pickle
+import queue
+import threading
+import zlib
+
+
+class DiskCache:
+    """
+    Persistent second cache tier behind the in-memory LRU caches.
+    Every entry is a zlib-compressed pickle in a directory that is sharded
+    by the first two hex digits of the key's hash. Nothing is read at
+    startup -- entries are loaded on access -- and writes happen
+    on a background thread.
+
+    If the entries exceed `max_mb`, the least recently used ones (by
+    modification time, which `get` refreshes) are deleted until the cache
+    is down to 90% of that size.
+    """
+
+    def __init__(self, directory, compress_level=3, max_mb=0):
+        """
+        :param max_mb: size limit in MB (0 = unlimited)
+        """
+        self.directory = os.path.abspath(directory)
+        self.compress_level = compress_level
+        self.max_bytes = max_mb * 1024 * 1024
+        self.size = None  # bytes on disk, computed by the writer thread
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.writes = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+        atexit.register(self.flush)
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:] + '.pkl.z')
+
+    def get(self, key):
+        """
+        :return: the stored object or None
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                stored_key, obj = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except (zlib.error, pickle.UnpicklingError, EOFError, ValueError):
+            logging.warning('ignoring corrupt cache entry for %s', key)
+            return None
+
+        # guard against hash collisions
+        if stored_key != key:
+            return None
+        if self.max_bytes:
+            try:
+                # recently used -- pruned last
+                os.utime(self._path(key))
+            except OSError:
+                pass
+        return obj
+
+    def put(self, key, obj):
+        # serialize right away, the cached object might change later on
+        blob = pickle.dumps((key, obj), protocol=pickle.HIGHEST_PROTOCOL)
+        self.writes.put((self._path(key), blob))
+
+    def flush(self):
+        """ blocks until all pending entries are written """
+        self.writes.join()
+
+    def _entries(self):
+        """ :return: [(mtime, size, path), ...] of all entries """
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.pkl.z'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _prune(self):
+        entries = sorted(self._entries())
+        self.size = sum(e[1] for e in entries)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+                removed += 1
+            except OSError:
+                pass
+        logging.info('pruned %d cache entries, %.1f MB left', removed,
+                     self.size / 1024 / 1024)
+
+    def _write_loop(self):
+        if self.max_bytes:
+            self.size = sum(e[1] for e in self._entries())
+        while True:
+            path, blob = self.writes.get()
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = path + '.tmp'
+                data = zlib.compress(blob, self.compress_level)
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, path)
+                if self.max_bytes:
+                    self.size += len(data)
+                    if self.size > self.max_bytes:
+                        self._prune()
+            except OSError as e:
+                logging.warning('could not write cache entry: %s', e)
+            finally:
+                self.writes.task_done()
@@ -0,0 +1,52 @@
+class FrozenDict(dict):
+    """
+    read-only dict -- still a dict, so responses that contain
+    it serialize to JSON as usual
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('cached translations are read-only, '
+                        'use translation_view()')
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        # pickle and copy would fill the new instance item by item
+        return FrozenDict, (dict(self),)
+
+
+def freeze(value):
+    """
+    read-only version of `value`: dicts become FrozenDicts and lists
+    tuples, all the way down
+    """
+    if isinstance(value, FrozenDict):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def freeze_translation(translation):
+    """
+    read-only version of a translation (as returned by server.translate)
+    for the caches: the token entries, beam, attention, scores and states
+    can't be changed by a request that shares the cached translation
+    """
+    return freeze(translation)
+
+
+def translation_view(translation):
+    """
+    copy of a (frozen) translation that can be annotated for a single
+    response -- down to the token entries all dicts are new,
+    everything below is shared with the cached translation.
+    """
+    view = dict(translation)
+    view['encoder'] = [dict(enc) for enc in translation['encoder']]
+    view['decoder'] = [[dict(dec) for dec in top]
+                       for top in translation['decoder']]
+    return view
@@ -0,0 +1,42 @@
+import importlib
+import logging
+import sys
+import time
+from collections import OrderedDict
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+# module name -> seconds it took to import it (first use only)
+IMPORT_TIMES = OrderedDict()
+
+
+def lazy_import(name):
+    """
+    imports module `name` on first use -- for heavy dependencies
+    (torch, sklearn, faiss, ...) that only some requests or projects need.
+    The time of the first import is logged and kept in IMPORT_TIMES.
+
+    :param name: module name, e.g. 'sklearn.manifold'
+    :return: the module
+    """
+    if name in sys.modules:
+        # (not sys.modules[name] -- while another thread still imports the
+        # module, only import_module waits for it to be initialized)
+        return importlib.import_module(name)
+
+    start = time.time()
+    module = importlib.import_module(name)
+    IMPORT_TIMES[name] = time.time() - start
+    logging.info('imported %s in %.2fs', name, IMPORT_TIMES[name])
+    return module
+
+
+def record_import(name, start):
+    """ records the import time of an eagerly imported block of modules """
+    IMPORT_TIMES[name] = time.time() - start
+
+
+def import_report():
+    """ :return: text table of all recorded import times, slowest first """
+    rows = sorted(IMPORT_TIMES.items(), key=lambda x: -x[1])
+    return '\n'.join('{:>8.3f}s  {}'.format(t, name) for name, t in rows)
@@ -1,16 +1,25 @@
+import threading
+
+
 class LRU:
 
     def __init__(self, k=5):
         self.k = k
         self.cache = []
         self.insert_to = 0
+        self.lock = threading.RLock()
 
     def preload(self, key, obj, persist=True):
-        self.add(key, obj)
-        if persist:
-            self.insert_to += 1
+        with self.lock:
+            self.add(key, obj)
+            if persist:
+                self.insert_to += 1
 
     def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
         i = 0
         l = len(self.cache)
         hit = None
@@ -27,6 +36,7 @@ class LRU:
             return None
 
     def add(self, key, obj):
-        self.cache.insert(self.insert_to, {'key': key, 'object': obj})
-        if len(self.cache) > self.k:
-            self.cache.pop()
+        with self.lock:
+            self.cache.insert(self.insert_to, {'key': key, 'object': obj})
+            if len(self.cache) > self.k:
+                self.cache.pop()
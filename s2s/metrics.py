@@ -0,0 +1,123 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+# upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """ :return: [(upper bound, number of values <= bound), ...] """
+        res = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            res.append((bound, total))
+        return res
+
+
+class Metrics:
+    """
+    Latency histograms per stage (translation, kNN search, projection, ...)
+    of all requests, and the stage timings of the current request
+    (per thread) for the Server-Timing header.
+
+    Stages are timed with `span`; stages that run in another thread than
+    the request (e.g. the encoder behind a MicroBatcher) still end up in
+    the histograms, but not in the timings of the request. Model worker
+    processes (--workers) keep their own, unreported histograms.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.histograms = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+        timings = getattr(self.local, 'timings', None)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0) + seconds
+
+    @contextmanager
+    def span(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.time() - start)
+
+    def start_request(self):
+        """ starts collecting the stage timings of this thread's request """
+        self.local.timings = OrderedDict()
+        self.local.start = time.time()
+        self.local.handler_end = None
+
+    def end_handler(self):
+        """ marks the end of the handler -- the response is serialized next """
+        self.local.handler_end = time.time()
+
+    def finish_request(self):
+        """
+        records the serialization (if `end_handler` was called) and the
+        total time of the request
+
+        :return: stage -> seconds for this request
+        """
+        timings = getattr(self.local, 'timings', None)
+        if timings is None:
+            return {}
+        now = time.time()
+        if self.local.handler_end is not None:
+            self.observe('serialize', now - self.local.handler_end)
+        self.observe('request', now - self.local.start)
+        self.local.timings = None
+        return timings
+
+    def render(self, prefix='s2s'):
+        """ :return: all histograms in the Prometheus text format """
+        name = prefix + '_stage_seconds'
+        lines = ['# HELP {} Latency of the request stages.'.format(name),
+                 '# TYPE {} histogram'.format(name)]
+        with self.lock:
+            for stage, histogram in self.histograms.items():
+                for bound, count in histogram.cumulative():
+                    lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                        name, stage, bound, count))
+                lines.append('{}_sum{{stage="{}"}} {}'.format(
+                    name, stage, histogram.sum))
+                lines.append('{}_count{{stage="{}"}} {}'.format(
+                    name, stage, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def server_timing(timings):
+    """ :return: value of a Server-Timing header for stage -> seconds """
+    return ', '.join('{};dur={:.2f}'.format(stage, t * 1000)
+                     for stage, t in timings.items())
+
+
+metrics = Metrics()
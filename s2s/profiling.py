@@ -0,0 +1,170 @@
+import cProfile
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+__author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
+
+PROFILE_EXTENSIONS = ['.prof', '.stacks.txt', '.json']
+
+
+def collapsed_stack(frame):
+    """
+    :return: stack of `frame` in the collapsed format of flamegraph.pl
+             and speedscope -- 'outer;...;inner'
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(
+            code.co_name, os.path.basename(code.co_filename),
+            code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class RequestProfiler:
+    """
+    Keeps profiles of requests that took at least `threshold_ms` (0 = all)
+    in `directory` -- the `keep` most recent ones:
+
+    - every request is watched by a stack sampler: one background thread
+      records the stack of each running request every `interval_ms`
+      (sys._current_frames), which costs the requests themselves next
+      to nothing. Profiles of slow requests are written as
+      `<name>.stacks.txt` (collapsed stacks with sample counts, e.g. for
+      flamegraph.pl or speedscope).
+    - a random sample (`sample_rate`) of the requests is additionally
+      profiled with cProfile (`<name>.prof`, for pstats or snakeviz).
+      Whether a request is sampled is decided before cProfile starts, so
+      the others don't pay for it. cProfile can only run once at a time
+      (per thread before python 3.12, per process after), requests that
+      cannot get it are only watched by the stack sampler.
+
+    `<name>` is `<time>_<ms>ms_<key hash>`, a `.json` file next to each
+    profile has the request key and duration.
+    """
+
+    def __init__(self, directory, threshold_ms=1000, sample_rate=0.,
+                 keep=50, interval_ms=10):
+        self.directory = directory
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.interval = interval_ms / 1000
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # thread id -> stack counts of the request running on it
+        self.running = {}
+        os.makedirs(directory, exist_ok=True)
+
+        self.sampler = threading.Thread(target=self._sample_loop,
+                                        daemon=True)
+        self.sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.running:
+                continue
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, stacks in self.running.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapsed_stack(frame)] += 1
+            del frames
+
+    def start(self):
+        """ starts watching (and maybe profiling) the current request """
+        self.local.start = time.time()
+        stacks = Counter()
+        with self.lock:
+            self.running[threading.get_ident()] = stacks
+        self.local.stacks = stacks
+
+        self.local.profile = None
+        if random.random() >= self.sample_rate:
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active
+            profile = None
+        self.local.profile = profile
+
+    def stop(self, key):
+        """
+        stops watching the current request and keeps its profiles if it
+        was slow
+
+        :param key: request key (e.g. path and query) stored with the profile
+        :return: file name of the kept profile or None
+        """
+        stacks = getattr(self.local, 'stacks', None)
+        if stacks is None:
+            return None
+        self.local.stacks = None
+        with self.lock:
+            self.running.pop(threading.get_ident(), None)
+        profile = self.local.profile
+        self.local.profile = None
+        if profile is not None:
+            profile.disable()
+
+        ms = (time.time() - self.local.start) * 1000
+        if ms < self.threshold_ms or not (stacks or profile):
+            return None
+
+        name = '{}_{}ms_{}'.format(
+            int(time.time() * 1000), int(ms),
+            hashlib.sha1(key.encode('utf-8')).hexdigest()[:10])
+        if profile is not None:
+            file = name + '.prof'
+            profile.dump_stats(os.path.join(self.directory, file))
+        else:
+            file = name + '.stacks.txt'
+        if stacks:
+            with open(os.path.join(self.directory, name + '.stacks.txt'),
+                      'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write('{} {}\n'.format(stack, count))
+        with open(os.path.join(self.directory, name + '.json'), 'w') as f:
+            json.dump({'profile': file, 'key': key,
+                       'stacks': name + '.stacks.txt' if stacks else None,
+                       'ms': round(ms, 1), 'time': time.time()}, f)
+        logging.info('profiled %s (%d ms): %s', key, ms, name)
+        self._rotate()
+        return file
+
+    def _rotate(self):
+        with self.lock:
+            names = sorted(f[:-len('.json')] for f in os.listdir(self.directory)
+                           if f.endswith('.json'))
+            for name in names[:-self.keep]:
+                for ext in PROFILE_EXTENSIONS:
+                    try:
+                        os.remove(os.path.join(self.directory, name + ext))
+                    except OSError:
+                        pass
+
+    def list(self, limit=50):
+        """ :return: info of the most recent profiles, newest first """
+        names = sorted((f for f in os.listdir(self.directory)
+                        if f.endswith('.json')), reverse=True)
+        res = []
+        for name in names[:limit]:
+            try:
+                with open(os.path.join(self.directory, name), 'r') as f:
+                    res.append(json.load(f))
+            except (OSError, ValueError):
+                # removed by a concurrent rotation
+                pass
+        return res
@@ -1,31 +1,54 @@
+import hashlib
+import logging
 import os
+import time
 
-import h5py
 import numpy as np
-from sklearn.externals import joblib
 
-from index.faissVectorIndex import FaissVectorIndex
-from model_api.opennmt_model import ONMTmodelAPI
-from index.annoyVectorIndex import AnnoyVectorIndex
+from model_api.registry import create_model_api
+from s2s.lazy import lazy_import
 
 __author__ = 'Hendrik Strobelt, Sebastian Gehrmann'
 import yaml
 
 
 class S2SProject:
-    def __init__(self, config_file, directory):
-        with open(config_file, 'rb') as cff:
-            self.config = yaml.load(cff)
-        self.model = ONMTmodelAPI(os.path.join(directory, self.config['model']))
+    def __init__(self, config_file, directory, workers=0, batch_size=0,
+                 batch_wait=0.005, model_api='pytorch'):
+        """
+        :param workers: model worker processes (pytorch backend)
+        :param model_api: backend for projects without `model_api` in
+                          their config (see model_api/registry.py)
+        """
+        self.directory = os.path.abspath(directory)
+        self.timings = {}
+        t = time.time()
+
+        self.config = load_config(config_file)
+        model_loc = os.path.join(directory, self.config['model'])
+        backend = self.config.get('model_api', model_api)
+        options = dict(self.config.get('model_api_options') or {})
+        self.fingerprint = model_fingerprint(model_loc, backend, options)
+        if backend == 'pytorch' and workers > 0:
+            backend = 'workers'
+        if backend == 'workers' and workers > 0:
+            options.setdefault('workers', workers)
+        self.model = create_model_api(backend, model_loc, **options)
+        if batch_size > 1:
+            from model_api.batcher import MicroBatcher
+            self.model = MicroBatcher(self.model, max_batch_size=batch_size,
+                                      max_wait=batch_wait)
+        t = self.log_stage('model', t)
+        h5py = lazy_import('h5py')
         self.embeddings = h5py.File(
             os.path.join(directory, self.config['embeddings']))
         self.train_data = h5py.File(
             os.path.join(directory, self.config['train']))
+        t = self.log_stage('hdf5', t)
         self.dicts = {'i2t': {'src': {}, 'tgt': {}},
                       't2i': {'src': {}, 'tgt': {}}}
 
         self.cached_norms = {'src': None, 'tgt': None}
-        self.directory = os.path.abspath(directory)
 
         self.indexType = self.config.get('indexType', 'annoy')
         self.has_neighbors = ('indices' in self.config)
@@ -36,8 +59,10 @@ class S2SProject:
 
         self.project_model = None
         if 'project_model' in self.config:
+            joblib = lazy_import('sklearn.externals.joblib')
             self.project_model = joblib.load(
                 os.path.join(directory, self.config['project_model']))
+            t = self.log_stage('project_model', t)
 
         for h in ['src', 'tgt']:
             with open(os.path.join(directory, self.config['dicts'][h])) as f:
@@ -51,6 +76,42 @@ class S2SProject:
                         self.dicts['i2t'][h][0] = '<unk>'  # todo: hack
                         self.dicts['t2i'][h][token] = iid
                     raw = f.readline()
+        self.log_stage('dicts', t)
+
+    def log_stage(self, stage, start):
+        """
+        records and logs the time since `start` for a loading stage
+
+        :return: current time -- the start of the next stage
+        """
+        now = time.time()
+        self.timings[stage] = now - start
+        logging.info('%s: %s loaded in %.2fs', self.directory, stage,
+                     self.timings[stage])
+        return now
+
+    def memory_estimate(self):
+        """
+        rough memory footprint in bytes: size of the model file, the
+        embeddings and all loaded indices on disk
+        """
+        files = [os.path.join(self.directory, self.config['model']),
+                 os.path.join(self.directory, self.config['embeddings'])]
+        if self.indices:
+            files += [self._index_path(name) for name in self.indices]
+        elif self.currentIndexName:
+            files.append(self._index_path(self.currentIndexName))
+        return sum(os.path.getsize(f) for f in files if os.path.exists(f))
+
+    def close(self):
+        """ releases model, files and indices of the project """
+        if hasattr(self.model, 'close'):
+            self.model.close()
+        self.embeddings.close()
+        self.train_data.close()
+        self.indices = None
+        self.currentIndex = None
+        self.currentIndexName = None
 
     def info(self):
         return {
@@ -86,9 +147,12 @@ class S2SProject:
             return [word_dict.get(x, '???') for x in indices if x != 1]
 
         res = []
-        for ix in ixs:
-            sentIx, tokIx = self.get_index('encoder').search_to_sentence_index(
-                ix)
+        # ids of the decoder (or context) states index are offsets into
+        # the target sentences, those of the encoder index into the sources
+        index_name = 'decoder' if data_src == 'tgt' else 'encoder'
+        sentIxs, tokIxs = self.get_index(index_name) \
+            .search_to_sentence_indices(ixs)
+        for sentIx, tokIx in zip(sentIxs.tolist(), tokIxs.tolist()):
             # Get raw list of tokens
             src_in = self.train_data['src'][sentIx]
             tgt_in = self.train_data['tgt'][sentIx]
@@ -114,7 +178,7 @@ class S2SProject:
         # print(tgt)
         return res
 
-    def _load_index(self, name):
+    def _index_path(self, name):
         path = None
         if 'indices' in self.config:
             if name in self.config['indices']:
@@ -125,12 +189,41 @@ class S2SProject:
             if self.indexType == 'faiss':
                 extension = ".faiss"
             path = os.path.join(self.directory, name + extension)
+        return path
+
+    def _load_index(self, name):
+        path = self._index_path(name)
 
         if os.path.exists(path):
+            params = self.config.get('indexParams', {}).get(name, {})
+            # only the index library of this project is imported
             if self.indexType == 'faiss':
-                return FaissVectorIndex(path)
+                FaissVectorIndex = lazy_import(
+                    'index.faissVectorIndex').FaissVectorIndex
+                return FaissVectorIndex(path,
+                                        nprobe=params.get('nprobe'),
+                                        efSearch=params.get('efSearch'))
             else:
-                return AnnoyVectorIndex(path)
+                AnnoyVectorIndex = lazy_import(
+                    'index.annoyVectorIndex').AnnoyVectorIndex
+                return AnnoyVectorIndex(path, dim_vector=params.get('dim'),
+                                        metric=params.get('metric', 'angular'))
+
+    def warm_up(self):
+        """
+        loads all configured indices, reads their files once (so memory
+        mapped ones are paged in) and computes the embedding norms
+        """
+        if self.has_neighbors:
+            names = list(self.config['indices'].keys())
+            self.preload_indices(names)
+            for name in names:
+                path = self._index_path(name)
+                for f in [path, path + '.offsets.npy', path + '.vectors']:
+                    if os.path.exists(f):
+                        page_in(f)
+        for loc, name in [('src', 'encoder'), ('tgt', 'decoder')]:
+            self.cached_norm(loc, self.embeddings[name][:])
 
     def preload_indices(self, names=[]):
         self.indices = {}
@@ -176,4 +269,84 @@ class S2SProject:
         # return self.indices[name]
 
 
+def page_in(file_name, chunk_size=16 * 1024 * 1024):
+    """ reads a file once, so the OS keeps its pages in memory """
+    with open(file_name, 'rb') as f:
+        while f.read(chunk_size):
+            pass
+
+
+def generated_config_file(config_file):
+    """
+    :return: path of the config that scripts (h5_to_faiss.py -config)
+             write their settings to -- s2s.yaml -> s2s.generated.yaml
+    """
+    return os.path.splitext(config_file)[0] + '.generated.yaml'
+
+
+def register_index(config_file, index_type, name, index_file, params,
+                   script):
+    """
+    registers an index in the generated config next to `config_file`
+    (s2s.generated.yaml) -- the hand-written s2s.yaml is not touched
+
+    :param params: search parameters of the index (indexParams)
+    :param script: name of the calling script, noted in the file
+    :return: path of the generated config
+    """
+    generated = generated_config_file(config_file)
+    config = {}
+    if os.path.exists(generated):
+        with open(generated, 'r') as f:
+            config = yaml.safe_load(f) or {}
+
+    config['indexType'] = index_type
+    config.setdefault('indices', {})[name] = os.path.relpath(
+        os.path.abspath(index_file),
+        os.path.dirname(os.path.abspath(config_file)))
+    config.setdefault('indexParams', {})[name] = params
+
+    with open(generated, 'w') as f:
+        f.write('# written by {} -- overrides the values of {}\n'.format(
+            script, os.path.basename(config_file)))
+        yaml.dump(config, f, default_flow_style=False)
+    return generated
+
+
+def load_config(config_file):
+    """
+    reads a project config and the generated config next to it -- the
+    generated values take precedence, sections (indices, indexParams, ...)
+    are merged per entry
+
+    :return: dict
+    """
+    with open(config_file, 'rb') as cff:
+        config = yaml.safe_load(cff) or {}
+    generated = generated_config_file(config_file)
+    if os.path.exists(generated):
+        with open(generated, 'rb') as f:
+            for key, value in (yaml.safe_load(f) or {}).items():
+                if isinstance(value, dict) and \
+                        isinstance(config.get(key), dict):
+                    config[key] = dict(config[key], **value)
+                else:
+                    config[key] = value
+    return config
+
 
+def model_fingerprint(model_loc, backend, options):
+    """
+    identifies the model behind a project -- path, size and modification
+    time of the model file and the backend settings. Persistent caches
+    include it in their keys, so a redeployed model is not served
+    the translations of its predecessor.
+    """
+    try:
+        st = os.stat(model_loc)
+        stamp = '{}:{}'.format(st.st_size, int(st.st_mtime))
+    except OSError:
+        stamp = 'missing'
+    return hashlib.sha1('{}|{}|{}|{}'.format(
+        os.path.abspath(model_loc), stamp, backend,
+        sorted(options.items())).encode('utf-8')).hexdigest()[:16]
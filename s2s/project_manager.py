@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from s2s.single_flight import SingleFlight
+
+
+class ProjectManager:
+    """
+    Keeps track of all project directories and loads a project on first
+    use. If the estimated memory of all loaded projects exceeds
+    `budget_mb`, the least recently used projects are unloaded.
+
+    Requests hold a project between `acquire` and `release`; an unloaded
+    project is only closed once its last user released it.
+    """
+
+    def __init__(self, loader, budget_mb=0):
+        """
+        :param loader: function (project_id, directory) -> S2SProject
+        :param budget_mb: memory budget for loaded projects (0 = unlimited)
+        """
+        self.loader = loader
+        self.budget_mb = budget_mb
+        self.directories = OrderedDict()
+        self.loaded = OrderedDict()
+        self.lock = threading.RLock()
+        self.loading = SingleFlight()
+        self.failed = {}
+        self.executor = None
+        self.background = []
+        self.completed = set()  # ids of projects that were loaded once
+        self.users = Counter()  # project -> number of users holding it
+        self.retired = set()  # unloaded projects that are still in use
+
+    def register(self, project_id, directory):
+        with self.lock:
+            self.directories[project_id] = directory
+
+    def ids(self):
+        return list(self.directories.keys())
+
+    def default_id(self):
+        return next(iter(self.directories), None)
+
+    def resolve_id(self, project_id=None):
+        """
+        :return: `project_id` or the default project's id if not given
+        """
+        return project_id or self.default_id()
+
+    def is_loaded(self, project_id):
+        return project_id in self.loaded
+
+    def status(self, project_id):
+        """
+        :return: 'loaded', 'loading', 'failed' or 'registered'
+                 (not loaded yet)
+        """
+        if project_id in self.loaded:
+            return 'loaded'
+        if project_id in self.loading.in_flight:
+            return 'loading'
+        if project_id in self.failed:
+            return 'failed'
+        return 'registered'
+
+    def ready(self):
+        """
+        :return: True once every registered project has been loaded (and
+                 warmed up by the loader) at least once and none failed
+                 -- later unloads over budget do not make it unready
+        """
+        with self.lock:
+            return not self.failed and \
+                all(p_id in self.completed for p_id in self.directories)
+
+    def load_all(self, threads=4, done=None):
+        """
+        loads all registered projects on a thread pool in the background.
+        Requests for a project that is still loading wait for it.
+
+        :param done: called without arguments once all loads finished
+                     (successful or not)
+        """
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.background = [
+            self.executor.submit(self._load_in_background, project_id)
+            for project_id in self.ids()]
+        if done is not None:
+            threading.Thread(target=lambda: (wait(self.background), done()),
+                             daemon=True).start()
+
+    def _load_in_background(self, project_id):
+        try:
+            self.get(project_id)
+        except Exception as e:
+            self.failed[project_id] = e
+            logging.exception('could not load project %s', project_id)
+
+    def get(self, project_id=None):
+        """
+        :param project_id: project id or None for the default project
+        :return: the loaded S2SProject
+        :raises KeyError: for unknown project ids
+        """
+        project_id = self.resolve_id(project_id)
+        if project_id not in self.directories:
+            raise KeyError(project_id)
+
+        with self.lock:
+            if project_id in self.loaded:
+                self.loaded.move_to_end(project_id)
+                return self.loaded[project_id]
+
+        return self.loading.do(project_id, lambda: self._load(project_id))
+
+    def acquire(self, project_id=None):
+        """
+        same as `get`, but the project is not closed when it is unloaded
+        before the matching `release`
+        """
+        while True:
+            project = self.get(project_id)
+            with self.lock:
+                # might have been unloaded (and closed) since `get`
+                if project in self.loaded.values():
+                    self.users[project] += 1
+                    return project
+
+    def release(self, project):
+        """ ends a use of `project` that started with `acquire` """
+        with self.lock:
+            if self.users[project] <= 0:
+                # acquired from another manager (or released twice)
+                del self.users[project]
+                raise ValueError('release of a project that is not in use')
+            self.users[project] -= 1
+            if self.users[project] > 0:
+                return
+            del self.users[project]
+            if project not in self.retired:
+                return
+            self.retired.remove(project)
+        project.close()
+        logging.info('closed unloaded project %s', project.directory)
+
+    def _load(self, project_id):
+        with self.lock:
+            if project_id in self.loaded:
+                return self.loaded[project_id]
+
+        start = time.time()
+        project = self.loader(project_id, self.directories[project_id])
+        logging.info('project %s loaded in %.2fs', project_id,
+                     time.time() - start)
+        with self.lock:
+            self.failed.pop(project_id, None)
+            self.completed.add(project_id)
+            self.loaded[project_id] = project
+            self._unload_over_budget(keep=project_id)
+        return project
+
+    def _unload_over_budget(self, keep):
+        if self.budget_mb <= 0:
+            return
+        used = sum(p.memory_estimate() for p in self.loaded.values())
+        for project_id in list(self.loaded.keys()):
+            if used <= self.budget_mb * 1024 * 1024:
+                break
+            if project_id == keep:
+                continue
+            project = self.loaded.pop(project_id)
+            used -= project.memory_estimate()
+            if self.users[project] > 0:
+                # closed by the last `release`
+                self.retired.add(project)
+            else:
+                self.users.pop(project, None)
+                project.close()
+            logging.info('unloaded project %s', project_id)
@@ -0,0 +1,33 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    De-duplicates concurrent computations: while `do(key, fn)` runs `fn`,
+    every other call with the same key waits for that result (or
+    exception) instead of running `fn` again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+        return future.result()
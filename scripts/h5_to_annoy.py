@@ -0,0 +1,113 @@
+import argparse
+import os
+import sys
+
+import h5py
+import numpy as np
+from annoy import AnnoyIndex
+
+from tqdm import tqdm
+
+# the index package (shared with the server) lives in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..'))
+from index.sentenceOffsets import without_padding
+from s2s.project import register_index
+print("Loaded libraries...")
+
+parser = argparse.ArgumentParser(
+    description='''h5_to_annoy.py is used to go
+                   from extracted states to
+                   an annoy index
+                   ''')
+parser.add_argument(
+    '-states',
+    required=True,
+    type=str,
+    help="""Path of the states file""")
+parser.add_argument(
+    '-data',
+    type=str,
+    default="decoder_out",
+    help="""Which set within the states to use""")
+
+parser.add_argument(
+    '-output', default="index.ann",
+    type=str,
+    help="""Path of the output file""")
+parser.add_argument(
+    '-stepsize', type=int, default=100,
+    help="""Read that many sequences at once
+            (larger = more memory, but faster).""")
+parser.add_argument(
+    '-trees', type=int, default=50,
+    help="""Number of trees (more = better recall, larger index)""")
+parser.add_argument(
+    '-n_jobs', type=int, default=-1,
+    help="""Threads used to build the trees (-1 = all cores)""")
+parser.add_argument(
+    '-metric', type=str, default="angular",
+    choices=['angular', 'euclidean', 'dot'],
+    help="""Distance metric of the index""")
+parser.add_argument(
+    '-config', type=str, default=None,
+    help="""Path of the project's s2s.yaml -- the index, its dimension
+            and metric are registered in s2s.generated.yaml next to
+            it.""")
+parser.add_argument(
+    '-name', type=str, default=None,
+    help="""Index name used in the config (encoder, decoder,
+            context). Defaults to the output file name.""")
+
+opt = parser.parse_args()
+
+
+def main():
+    f = h5py.File(opt.states, "r")
+    data = f[opt.data]
+    seqs, slens, hid = data.shape
+
+    print("Processing {} Sequences".format(seqs))
+    print("with {} tokens each".format(slens))
+    print("and {} states".format(hid))
+
+    # Initialize a new index that is built in the output file
+    # instead of in RAM
+    index = AnnoyIndex(hid, opt.metric)
+    index.on_disk_build(opt.output)
+
+    lengths = []
+    item = 0
+    with open(opt.output + '.vectors', 'wb') as vectors:
+        for ix in tqdm(range(0, seqs, opt.stepsize)):
+            cdata, clens = without_padding(
+                np.array(data[ix:ix + opt.stepsize], dtype="float32"))
+            for v in cdata:
+                index.add_item(item, v)
+                item += 1
+            vectors.write(cdata.tobytes())
+            lengths.append(clens)
+    f.close()
+
+    lengths = np.concatenate(lengths)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype('int64')
+    np.save(opt.output + '.offsets.npy', offsets)
+
+    print("Building {} trees over {} states".format(opt.trees, item))
+    try:
+        index.build(opt.trees, n_jobs=opt.n_jobs)
+    except TypeError:
+        # annoy < 1.17 has no parallel build
+        index.build(opt.trees)
+    index.unload()
+
+    if opt.config:
+        name = opt.name or os.path.splitext(os.path.basename(opt.output))[0]
+        generated = register_index(opt.config, 'annoy', name, opt.output,
+                                   {'dim': hid, 'metric': opt.metric},
+                                   'scripts/h5_to_annoy.py')
+        print("Registered index '{}' in {}".format(name, generated))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,22 @@
 import argparse
+import os
+import sys
+
+# scripts/ also holds an old macOS build of faiss (faiss.py,
+# _swigfaiss.so) -- import the installed faiss instead
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path = [p for p in sys.path if os.path.abspath(p or '.') != SCRIPT_DIR]
+
 import faiss
 import h5py
 import numpy as np
 
 from tqdm import tqdm
+
+# the index package (shared with the server) lives in the repository root
+sys.path.append(os.path.join(SCRIPT_DIR, '..'))
+from index.sentenceOffsets import without_padding
+from s2s.project import register_index
 print("Loaded libraries...")
 
 parser = argparse.ArgumentParser(
@@ -30,9 +43,72 @@ parser.add_argument(
     '-stepsize', type=int, default=100,
    help="""Add that many sequences at once
            (larger = more memory, but faster).""")
+parser.add_argument(
+    '-index_type', type=str, default="Flat",
+    help="""Faiss index factory string, e.g. Flat (exact),
+            IVF4096,Flat or IVF4096,PQ50 (inverted lists)
+            or HNSW32 (graph based).""")
+parser.add_argument(
+    '-metric', type=str, default="ip", choices=['ip', 'l2'],
+    help="""Similarity metric: inner product or L2 distance""")
+parser.add_argument(
+    '-train_size', type=int, default=100000,
+    help="""Number of state vectors sampled to train
+            the index (ignored for index types without training).""")
+parser.add_argument(
+    '-nprobe', type=int, default=None,
+    help="""Default number of inverted lists visited
+            per query (IVF types) -- stored in the config.""")
+parser.add_argument(
+    '-efSearch', type=int, default=None,
+    help="""Default search depth per query (HNSW types)
+            -- stored in the config.""")
+parser.add_argument(
+    '-config', type=str, default=None,
+    help="""Path of the project's s2s.yaml -- the index and its search
+            parameters are registered in s2s.generated.yaml next to
+            it.""")
+parser.add_argument(
+    '-name', type=str, default=None,
+    help="""Index name used in the config (encoder, decoder,
+            context). Defaults to the output file name.""")
 
 opt = parser.parse_args()
 
+
+def train_sample(data, size):
+    """
+    draws a random sample of (at most) `size` real token state vectors
+    from whole sequences of the states dataset -- sequences are read
+    until enough tokens (not padding) are collected
+
+    :param data: states dataset (seqs x slens x hid)
+    :param size: number of vectors to sample
+    :return: float32 array (n x hid)
+    """
+    seqs, slens, hid = data.shape
+    order = np.random.permutation(seqs)
+    chunks = []
+    n = 0
+    read = 0
+    tokens_per_seq = slens  # estimate until the first sequences are read
+    while n < size and read < seqs:
+        n_seqs = max(1, int(np.ceil((size - n) / tokens_per_seq)))
+        # h5py requires increasing indices for fancy indexing
+        sample = np.sort(order[read:read + n_seqs])
+        vectors, _ = without_padding(
+            np.array(data[sample.tolist()], dtype="float32"))
+        chunks.append(vectors)
+        n += len(vectors)
+        read += len(sample)
+        tokens_per_seq = max(n / read, 1)
+    vectors = np.concatenate(chunks)
+    if len(vectors) > size:
+        vectors = vectors[np.random.choice(len(vectors), size,
+                                           replace=False)]
+    return vectors
+
+
 def main():
     f = h5py.File(opt.states, "r")
     data = f[opt.data]
@@ -43,15 +119,42 @@ def main():
     print("and {} states".format(hid))
 
     # Initialize a new index
-    index = faiss.IndexFlatIP(hid)
-    # Fill it
-    for ix in tqdm(range(0, seqs-opt.stepsize, opt.stepsize)):
-        cdata = np.array(data[ix:ix+opt.stepsize]\
-                  .reshape(-1, hid), dtype="float32")
+    metric = faiss.METRIC_INNER_PRODUCT if opt.metric == 'ip' \
+        else faiss.METRIC_L2
+    index = faiss.index_factory(hid, opt.index_type, metric)
+
+    if not index.is_trained:
+        sample = train_sample(data, opt.train_size)
+        print("Training {} on {} samples".format(opt.index_type,
+                                                  len(sample)))
+        index.train(sample)
+
+    # Fill it with the real tokens only
+    lengths = []
+    for ix in tqdm(range(0, seqs, opt.stepsize)):
+        cdata, clens = without_padding(
+            np.array(data[ix:ix+opt.stepsize], dtype="float32"))
         index.add(cdata)
+        lengths.append(clens)
     f.close()
 
     faiss.write_index(index, opt.output)
 
+    # offset of every sentence to map ids back to (sentence, position)
+    lengths = np.concatenate(lengths)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype('int64')
+    np.save(opt.output + '.offsets.npy', offsets)
+
+    if opt.config:
+        params = {'factory': opt.index_type, 'metric': opt.metric}
+        if opt.nprobe is not None:
+            params['nprobe'] = opt.nprobe
+        if opt.efSearch is not None:
+            params['efSearch'] = opt.efSearch
+        name = opt.name or os.path.splitext(os.path.basename(opt.output))[0]
+        generated = register_index(opt.config, 'faiss', name, opt.output,
+                                   params, 'scripts/h5_to_faiss.py')
+        print("Registered index '{}' in {}".format(name, generated))
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
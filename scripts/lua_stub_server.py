@@ -0,0 +1,62 @@
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+parser = argparse.ArgumentParser(
+    description='''lua_stub_server.py answers like the OpenNMT (lua)
+                   translation server -- to test the lua model API
+                   (model_api: lua) without a model. The "translation"
+                   is the reversed source sentence.
+                   ''')
+parser.add_argument(
+    '-port', type=int, default=7784,
+    help="""Port of the server""")
+parser.add_argument(
+    '-path', type=str, default="/translator/translate",
+    help="""Path of the translation endpoint""")
+
+opt = parser.parse_args()
+
+
+def stub_translation(src):
+    tokens = src.split()
+    tgt = list(reversed(tokens))
+    n = max(len(tokens), 1)
+    return {'src': src, 'tgt': ' '.join(tgt),
+            'pred_score': -float(len(tgt)),
+            'attn': [[1. / n] * len(tokens) for _ in tgt],
+            'n_best': 1}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_POST(self):
+        if self.path != opt.path:
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        batch = json.loads(self.rfile.read(length).decode('utf-8'))
+        body = json.dumps([[stub_translation(item['src'])]
+                           for item in batch]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    server = ThreadingServer(('127.0.0.1', opt.port), Handler)
+    print("Serving stub translations on http://127.0.0.1:{}{}".format(
+        opt.port, opt.path))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import sys
+import threading
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from model_api.registry import create_model_api
+
+parser = argparse.ArgumentParser(
+    description='''model_worker_server.py runs a model backend on a
+                   worker machine for the remote model API
+                   (model_api: remote). It answers POSTs of the
+                   arguments of translate as JSON.
+                   ''')
+parser.add_argument(
+    '-model', type=str, required=True,
+    help="""Model file""")
+parser.add_argument(
+    '-api', type=str, default='pytorch',
+    help="""Model backend that translates (pytorch, workers, stub, ...).
+            pytorch translates one request at a time, use workers to
+            translate several at once.""")
+parser.add_argument(
+    '-options', type=str, default='{}',
+    help="""Keyword arguments of the backend as JSON, e.g. '{"gpu": 0}'""")
+parser.add_argument(
+    '-host', type=str, default='127.0.0.1',
+    help="""Interface to listen on""")
+parser.add_argument(
+    '-port', type=int, default=7785,
+    help="""Port of the server""")
+parser.add_argument(
+    '-path', type=str, default="/translate",
+    help="""Path of the translation endpoint""")
+
+opt = parser.parse_args()
+model_api = None
+# backends that can be called from several threads at once --
+# requests for all others are translated one after the other
+THREAD_SAFE = {'workers', 'remote', 'lua', 'stub'}
+translate_lock = nullcontext() if opt.api in THREAD_SAFE \
+    else threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_POST(self):
+        if self.path != opt.path:
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length).decode('utf-8'))
+        try:
+            with translate_lock:
+                reply = model_api.translate(
+                    request['in_text'],
+                    partial_decode=request.get('partial_decode', []),
+                    attn_overwrite=request.get('attn_overwrite', []),
+                    k=request.get('k', 5),
+                    roundTo=request.get('roundTo', 5))
+        except Exception as e:
+            self.send_error(500, explain=repr(e))
+            return
+        body = json.dumps(reply).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    global model_api
+    model_api = create_model_api(opt.api, opt.model,
+                                 **json.loads(opt.options))
+    server = ThreadingServer((opt.host, opt.port), Handler)
+    print("Serving {} translations on http://{}:{}{}".format(
+        opt.api, opt.host, opt.port, opt.path))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
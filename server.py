@@ -1,32 +1,51 @@
 #!/usr/bin/env python3
 
 import argparse
+import multiprocessing
 import os
 import time
 
+_import_start = time.time()
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 import connexion
 import logging
 
 # import umap
-from flask import send_from_directory, redirect, json
+from flask import send_from_directory, redirect, json, abort, jsonify
+from flask import Response, request as flask_request
+from flask import g, has_request_context
 import numpy as np
-from sklearn.decomposition import PCA
-from sklearn.manifold import MDS, TSNE
-
-from copy import deepcopy
 
+from model_api.registry import BACKENDS
+from s2s.cache_manifest import load_manifest
+from s2s.disk_cache import DiskCache
+from s2s.frozen import freeze, freeze_translation, translation_view
+from s2s.lazy import IMPORT_TIMES, lazy_import, record_import, \
+    import_report
 from s2s.lru import LRU
+from s2s.metrics import metrics, server_timing
+from s2s.profiling import RequestProfiler
+from s2s.project_manager import ProjectManager
+from s2s.single_flight import SingleFlight
 from s2s.project import S2SProject
-from index.annoyVectorIndex import AnnoyVectorIndex
+
+record_import('server (eager imports)', _import_start)
 
 __author__ = 'Hendrik Strobelt, Sebastian Gehrmann, Alexander M. Rush'
 CONFIG_FILE_NAME = 's2s.yaml'
-projects = {}
+projects = ProjectManager(lambda p_id, p_dir: load_project(p_id, p_dir))
 cache_translate = LRU(50)
-# cache_neighbors = LRU(20)
+cache_neighbors = LRU(20)
 cache_compare = LRU(50)
+# settings of the neighborhoods computed for /translate
+NEIGHBOR_P_METHOD = 'tsne'
+NEIGHBOR_K = 100
+in_flight = SingleFlight()
+store = None  # type: DiskCache
+profiler = None  # type: RequestProfiler
 pre_cached = []
+pre_cached_files = {}
+warmup_sentences = []
 
 logging.basicConfig(level=logging.INFO)
 app = connexion.App(__name__)
@@ -39,26 +58,60 @@ parser.add_argument("--port", default="8080", help="Port to run the app. ")
 parser.add_argument("--preload", action='store_true', help="Preload indices.")
 parser.add_argument("--cache", type=str, default='',
                     help="Preload cache from dir")
+parser.add_argument("--workers", type=int, default=0,
+                    help="Number of model worker processes per project "
+                         "(0 = translate in the server process)")
+parser.add_argument("--batch_size", type=int, default=0,
+                    help="Max. number of sentences decoded as one batch "
+                         "(0 = no batching of concurrent requests)")
+parser.add_argument("--batch_wait", type=float, default=5,
+                    help="Time (ms) to wait for requests to fill a batch")
+parser.add_argument("--store", type=str, default='',
+                    help="Directory of the persistent translation cache")
+parser.add_argument("--store_mb", type=int, default=1024,
+                    help="Size limit (MB) of --store, least recently used "
+                         "entries are deleted (0 = unlimited)")
+parser.add_argument("--neighbor_cache", type=int, default=20,
+                    help="Number of neighborhood results kept in memory")
+parser.add_argument("--project_budget", type=int, default=0,
+                    help="Memory budget (MB) for loaded projects -- least "
+                         "recently used ones are unloaded (0 = unlimited)")
+parser.add_argument("--load_threads", type=int, default=4,
+                    help="Threads loading the projects in the background "
+                         "at startup (0 = load each project on first use)")
+parser.add_argument("--warmup", type=str, default='',
+                    help="Warm up every project before it serves requests: "
+                         "load and page in all indices and translate "
+                         "the sentences of this file (one per line)")
+parser.add_argument("--timing_header", action='store_true',
+                    help="Add a Server-Timing header with the time of "
+                         "each stage to every response")
+parser.add_argument("--profile", type=str, default='',
+                    help="Profile requests (stack sampling, cProfile) and "
+                         "keep the profiles of slow ones in this directory")
+parser.add_argument("--profile_ms", type=int, default=1000,
+                    help="Keep profiles of requests slower than this (ms, "
+                         "0 = keep all profiles)")
+parser.add_argument("--profile_rate", type=float, default=0.,
+                    help="Fraction of requests that are also profiled "
+                         "with cProfile")
+parser.add_argument("--profile_interval", type=int, default=10,
+                    help="Stack sampling interval (ms)")
+parser.add_argument("--profile_keep", type=int, default=50,
+                    help="Number of profiles kept in --profile")
 parser.add_argument("--dir", type=str,
                     default=os.path.abspath('data'),
                     help='Path to project')
 
-# parser.add_argument('-api', type=str, default='pytorch',
-#                     choices=['pytorch', 'lua'],
-#                     help="""The API to use.""")
-args = parser.parse_args()
+parser.add_argument('--api', type=str, default='pytorch',
+                    choices=sorted(BACKENDS.keys()),
+                    help="Model backend of projects without `model_api` "
+                         "in their s2s.yaml")
+args, _ = parser.parse_known_args()
 
 print(args)
 
 
-# global model
-# if args.api == "pytorch":
-#     # model = ONMTmodelAPI("model_api/data/ende_acc_15.72_ppl_912.74_e9.pt")
-#     model = ONMTmodelAPI("model_api/data/ende_acc_46.86_ppl_21.19_e12.pt")
-# else:
-#     model = ONMTLuaModelAPI()
-
-
 # just a simple flask route
 @app.route('/')
 def hello_world():
@@ -85,8 +138,70 @@ def send_static_dep(path):
     return send_from_directory('node_modules/', path)
 
 
-def closest_vector_n(index, v, r=5):
-    res = index.get_closest_x(v, k=100,
+@app.route('/health')
+def health():
+    """ 200 once all projects are loaded (and warmed up), 503 before """
+    ready = projects.ready()
+    return jsonify({
+        'ready': ready,
+        'projects': {p_id: projects.status(p_id) for p_id in projects.ids()},
+        # seconds per module -- heavy ones are imported by the loaders
+        'imports': {name: round(t, 3) for name, t in IMPORT_TIMES.items()}
+    }), 200 if ready else 503
+
+
+@app.route('/metrics')
+def get_metrics():
+    """ latency histograms of all stages in the Prometheus text format """
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/profiles')
+def get_profiles():
+    """ lists the most recent profiles of slow (sampled) requests """
+    if profiler is None:
+        abort(404, 'profiling is not enabled (--profile)')
+    return jsonify(profiler.list())
+
+
+@app.route('/profiles/<path:path>')
+def send_profile(path):
+    if profiler is None:
+        abort(404, 'profiling is not enabled (--profile)')
+    return send_from_directory(os.path.abspath(profiler.directory), path)
+
+
+@app.app.before_request
+def start_timing():
+    metrics.start_request()
+    if profiler:
+        profiler.start()
+
+
+@app.app.after_request
+def finish_timing(response):
+    timings = metrics.finish_request()
+    if args.timing_header and timings:
+        response.headers['Server-Timing'] = server_timing(timings)
+    return response
+
+
+@app.app.teardown_request
+def release_projects(exception=None):
+    for project in g.pop('projects', []):
+        projects.release(project)
+
+
+@app.app.teardown_request
+def stop_profiling(exception=None):
+    # teardown runs for failed requests too -- after_request doesn't
+    if profiler:
+        profiler.stop(flask_request.full_path)
+
+
+def closest_vector_n(index, v, k=100, r=5):
+    res = index.get_closest_x(v, k=k,
                               ignore_same_tgt=False,
                               include_distances=True,
                               use_vectors=True)
@@ -103,7 +218,9 @@ def project_states(vectors, p_method='pca', anchors=None):
     # else:
     #     pm = P_METHODS[p_method]
 
-    pm = P_METHODS[p_method]
+    # (sklearn's TSNE only accepts arrays)
+    vectors = np.asarray(vectors)
+    pm = P_METHODS[p_method](len(vectors))
     anchors = None  # TODO: remove fix
 
     if anchors:
@@ -123,9 +240,11 @@ def projection_hnlp(model, states, lengths):
     w = model.coef_
     w = np.expand_dims(w, 1)
     v_prime = v - np.dot(np.dot(v, w), w.T)
-    y_pos_b = (TSNE(n_components=1, init='pca').fit_transform(v_prime)) \
-        .flatten()
-    y_pos_c = (PCA(n_components=1).fit_transform(v_prime)) \
+    manifold = lazy_import('sklearn.manifold')
+    decomposition = lazy_import('sklearn.decomposition')
+    y_pos_b = (manifold.TSNE(n_components=1, init='pca')
+               .fit_transform(v_prime)).flatten()
+    y_pos_c = (decomposition.PCA(n_components=1).fit_transform(v_prime)) \
         .flatten()
 
     return x_pos.tolist(), y_pos_a.tolist(), y_pos_b.tolist(), y_pos_c.tolist()
@@ -140,7 +259,7 @@ def create_proj_list(xs, ys, traces):
     return res
 
 
-def all_neighbors(project, translations, neighbors, p_method='tsne'):
+def all_neighbors(project, translations, neighbors, p_method='tsne', k=100):
     # pca = umap.UMAP()#TSNE(n_components=2)
 
     nr_nn_for_projection = 20
@@ -161,7 +280,7 @@ def all_neighbors(project, translations, neighbors, p_method='tsne'):
                     all_enc_states = list(
                         map(lambda x: x['state'], translation['encoder']))
                     states.append(all_enc_states)
-                    closest_v = closest_vector_n(index, all_enc_states)
+                    closest_v = closest_vector_n(index, all_enc_states, k)
                     for e_id, enc in enumerate(translation['encoder']):
                         n_cand_local = closest_v[e_id]
                         enc['neighbors'] = n_cand_local
@@ -174,7 +293,7 @@ def all_neighbors(project, translations, neighbors, p_method='tsne'):
                                           translation['decoder'][0]))
 
                     states.append(all_states)
-                    closest_v = closest_vector_n(index, all_states)
+                    closest_v = closest_vector_n(index, all_states, k)
 
                     bId = 0
                     # for beam in [translation['decoder'][0]]:
@@ -192,7 +311,7 @@ def all_neighbors(project, translations, neighbors, p_method='tsne'):
                     all_states = list(map(lambda x: x['context'],
                                           translation['decoder'][0]))
                     states.append(all_states)
-                    closest_v = closest_vector_n(index, all_states)
+                    closest_v = closest_vector_n(index, all_states, k)
 
                     bId = 0
                     # for beam in translation['decoder']:
@@ -206,6 +325,8 @@ def all_neighbors(project, translations, neighbors, p_method='tsne'):
                                  'n': n_cand_local[:nr_nn_for_projection]})
                     bId += 1
 
+        metrics.observe('knn_' + neighborhood, time.time() - start_t)
+        start_t = time.time()
         for all_cand in n_cand[0]:  # for now only first entry
             # print(neighborhood, len(nb_summary), all_cand)
             for n_cand_x in all_cand['n']:
@@ -248,15 +369,17 @@ def all_neighbors(project, translations, neighbors, p_method='tsne'):
 
         nb_summary_list = nb_summary_list + sentence_traces
         #
-        print('index-time:', str(time.time() - start_t))
+        metrics.observe('vectors', time.time() - start_t)
         start_t = time.time()
         positions = project_states([x['v'] for x in nb_summary_list],
                                    p_method, anchors=sentence_states)
         for i in range(len(positions)):
             nb_summary_list[i]['pos'] = positions[i].tolist()
             # nb_summary_list[i]['v']
+        metrics.observe('projection', time.time() - start_t)
 
         if project.project_model:
+            start_t = time.time()
             x_pos, y_pos_a, y_pos_b, y_pos_c = projection_hnlp(
                 project.project_model,
                 sentence_states,
@@ -268,9 +391,7 @@ def all_neighbors(project, translations, neighbors, p_method='tsne'):
                                                         sentence_traces)
             res[neighborhood + '_c'] = create_proj_list(x_pos, y_pos_c,
                                                         sentence_traces)
-
-        print('proj-time:', str(time.time() - start_t))
-        #
+            metrics.observe('hnlp', time.time() - start_t)
 
         res[neighborhood] = nb_summary_list
 
@@ -308,10 +429,11 @@ def translate(project, in_sentences, partial=[], attn_overwrite=[]):
         par = partial[transID] if (transID < len(partial)) else []
         par = [par] if len(par) else []
         print(transID, in_sentence, par)
-        translations[transID] = model.translate(in_text=[in_sentence],
-                                                partial_decode=par,
-                                                attn_overwrite=attn_overwrite)[
-            0]
+        with metrics.span('translate'):
+            translations[transID] = model.translate(
+                in_text=[in_sentence], partial_decode=par,
+                attn_overwrite=attn_overwrite)[0]
+    word_start = time.time()
     tgt_dict = project.dicts['i2t']['tgt']
     for _, trans in translations.items():
         for tk in trans['beam']:
@@ -328,14 +450,16 @@ def translate(project, in_sentences, partial=[], attn_overwrite=[]):
                     trace_collect.append(tgt_dict.get(w_id, '??'))
                 level_collect.append(trace_collect)
             trans['beam_trace_words'].append(level_collect)
+    metrics.observe('word_mapping', time.time() - word_start)
 
     return translations
 
 
 # ------ API routing as defined in swagger.yaml (connexion)
 def get_translation(**request):
-    current_project = list(projects.values())[0]  # type: S2SProject
+    current_project = get_project(request)  # type: S2SProject
 
+    parse_start = time.time()
     in_sentence = request['in']
     neighbors = request.get('neighbors', [''])
     partials = request.get('partial', [''])
@@ -359,56 +483,104 @@ def get_translation(**request):
             is_key = not is_key
         attn_overwrite.append(att)
 
-    translation_id = in_sentence + str(partials) + str(force_attn)
-    translations = cache_translate.get(translation_id)
+    translation_id = translation_key(request)
+    # the persistent store outlives model redeploys
+    store_key = current_project.fingerprint + '|' + translation_id
+    metrics.observe('parse', time.time() - parse_start)
+    with metrics.span('cache_lookup'):
+        translations = cache_translate.get(translation_id)
     if not translations:
-        translations = translate(current_project, [in_sentence],
-                                 partial=partials,
-                                 attn_overwrite=attn_overwrite)
-        cache_translate.add(translation_id, translations)
-
-    res = translations[0]
+        def compute_translation():
+            # a concurrent identical request might have just filled it
+            with metrics.span('cache_lookup'):
+                cached = cache_translate.get(translation_id)
+                if not cached:
+                    cached = load_pre_cached(translation_id)
+                trans = None
+                if not cached and store:
+                    trans = store.get(store_key)
+            if cached:
+                return cached
+            if not trans:
+                trans = translate(current_project, [in_sentence],
+                                  partial=partials,
+                                  attn_overwrite=attn_overwrite)
+                if store:
+                    store.put(store_key, trans)
+            trans = {t_id: freeze_translation(t) for t_id, t in trans.items()}
+            cache_translate.add(translation_id, trans)
+            return trans
+
+        translations = in_flight.do(('translate', translation_id),
+                                    compute_translation)
+
+    # cached translations are read-only -- neighbors and request
+    # are added to a view for this response
+    res = translation_view(translations[0])
+    res.pop('allNeighbors', None)
 
     if len(neighbors) > 0:
-        # neighbor_id = in_sentence + str(partials) + str(force_attn) + str(
-        #     neighbors)
-        # all_n = cache_neighbors.get(neighbor_id)
-
-        if 'allNeighbors' not in res:
-            res['allNeighbors'] = all_neighbors(current_project, translations,
-                                                neighbors)
-            # cache_neighbors.add(neighbor_id, all_n)
-
-        # res['allNeighbors'] = all_n
+        neighbor_id = neighbor_key(translation_id, neighbors)
+        all_n = cache_neighbors.get(neighbor_id)
+        if not all_n:
+            def compute_neighbors():
+                cached = cache_neighbors.get(neighbor_id)
+                if cached:
+                    return cached
+                view = translation_view(translations[0])
+                n = all_neighbors(current_project, {0: view}, neighbors,
+                                  p_method=NEIGHBOR_P_METHOD, k=NEIGHBOR_K)
+                # shared by all responses, like the cached translations
+                cached = freeze({'neighbors': n,
+                                 'tokens': token_neighbors(view)})
+                cache_neighbors.add(neighbor_id, cached)
+                return cached
+
+            all_n = in_flight.do(('neighbors', neighbor_id),
+                                 compute_neighbors)
+
+        apply_token_neighbors(res, all_n['tokens'])
+        res['allNeighbors'] = all_n['neighbors']
 
     res['request'] = request
+    metrics.end_handler()
     return res
 
 
 def get_translation_compare(**request):
-    current_project = list(projects.values())[0]
+    current_project = get_project(request)
 
     in_sentence = request['in']
     compare_sentence = request['compare']
     neighbors = request.get('neighbors', [])
     neighbors = [] if neighbors == [''] else neighbors
 
-    key = in_sentence + ' VS ' + compare_sentence + str(neighbors)
+    key = projects.resolve_id(request.get('project_id')) + '|' \
+        + in_sentence + ' VS ' + compare_sentence + str(neighbors)
 
     res = cache_compare.get(key)
     if res:
         return res
 
-    translations = translate(current_project, [in_sentence, compare_sentence])
-    res = {'in': translations[0], 'compare': translations[1]}
+    def compute_compare():
+        cached = cache_compare.get(key)
+        if cached:
+            return cached
 
-    if len(neighbors) > 0:
-        all_n = all_neighbors(current_project, translations, neighbors)
-        res['neighbors'] = all_n
+        translations = translate(current_project,
+                                 [in_sentence, compare_sentence])
+        compare = {'in': translations[0], 'compare': translations[1]}
 
-    cache_compare.add(key, res)
+        if len(neighbors) > 0:
+            all_n = all_neighbors(current_project, translations, neighbors)
+            compare['neighbors'] = all_n
 
-    return res
+        # shared by all requests for this comparison from now on
+        compare = freeze(compare)
+        cache_compare.add(key, compare)
+        return compare
+
+    return in_flight.do(('compare', key), compute_compare)
 
 
 def extract_sentence(x):
@@ -468,17 +640,22 @@ def extract_attn(x):
 #     return {"compare": res, "pivot": extract_sentence(pivot_res)}
 
 
+# factories of the projection methods -- sklearn is imported on first use
 P_METHODS = {
-    "pca": PCA(n_components=2, ),
-    "mds": MDS(),
-    "tsne": TSNE(init='pca'),
-    # 'umap': umap.UMAP(metric='cosine'),
-    "none": lambda x: x
+    # n: number of points that will be projected
+    "pca": lambda n=None: lazy_import('sklearn.decomposition').PCA(
+        n_components=2, ),
+    "mds": lambda n=None: lazy_import('sklearn.manifold').MDS(),
+    # (the perplexity must be below the number of points)
+    "tsne": lambda n=100: lazy_import('sklearn.manifold').TSNE(
+        init='pca', perplexity=min(30., max(n - 1, 1))),
+    # 'umap': lambda: umap.UMAP(metric='cosine'),
+    "none": lambda n=None: (lambda x: x)
 }
 
 
 def get_close_words(**request):
-    current_project = list(projects.values())[0]  # type: S2SProject
+    current_project = get_project(request)  # type: S2SProject
     loc = request['loc']  # "src" or "tgt"
     limit = request['limit']
     p_method = request["p_method"]
@@ -511,7 +688,7 @@ def get_close_words(**request):
     # projection methods: MDS, PCA, tSNE -- all with standard params
     positions = []
     if p_method != "none":
-        positions = P_METHODS[p_method].fit_transform(
+        positions = P_METHODS[p_method](len(neighbour_ids)).fit_transform(
             matrix[neighbour_ids, :])
 
     return {'word': names,
@@ -522,27 +699,28 @@ def get_close_words(**request):
 
 
 def get_neighbor_details(**request):
-    current_project = list(projects.values())[0]
+    current_project = get_project(request)
 
     indices = request['indices']
     index = current_project.get_index(
         request["vector_name"])  # type: AnnoyVectorIndex
 
-    return index.get_details(indices)
+    return index.get_details(indices, half=request.get('half', False))
 
 
 def get_info(**request):
-    if 'project_id' not in request:
-        current_project = list(projects.values())[0]  # type: S2SProject
-        res = current_project.info()
-        res['pre_cached'] = pre_cached
-        return res
-
-    return request
+    current_project = get_project(request)
+    res = current_project.info()
+    res['project_id'] = projects.resolve_id(request.get('project_id'))
+    res['projects'] = projects.ids()
+    res['pre_cached'] = [r for r in pre_cached
+                         if projects.resolve_id(r.get('project_id'))
+                         == res['project_id']]
+    return res
 
 
 def get_close_vectors(**request):
-    current_project = list(projects.values())[0]  # type: S2SProject
+    current_project = get_project(request)  # type: S2SProject
     # os.path.join(current_project.directory, request["vector_name"] + ".ann")
     index = current_project.get_index(
         request["vector_name"])  # type: AnnoyVectorIndex
@@ -557,7 +735,7 @@ def train_data_for_index(**request):
     ids = request["indices"]
     loc = request["loc"]
 
-    current_project = list(projects.values())[0]  # type: S2SProject
+    current_project = get_project(request)  # type: S2SProject
     res = current_project.get_train_for_index(ids, loc)
 
     return {'loc': loc, 'ids': ids, 'res': res}
@@ -576,51 +754,161 @@ def find_and_load_project(directory):
         if CONFIG_FILE_NAME in files:
             project_dirs.append(os.path.abspath(root))
 
-    i = 0
     for p_dir in project_dirs:
         dh_id = os.path.split(p_dir)[1]
-        cf = os.path.join(p_dir, CONFIG_FILE_NAME)
-        p = S2SProject(directory=p_dir, config_file=cf)
-        if args.preload:
-            p.preload_indices(['encoder', 'decoder'])
-        projects[dh_id] = p
-
-        i += 1
+        projects.register(dh_id, p_dir)
+
+
+def load_project(project_id, p_dir):
+    logging.info('loading project %s', project_id)
+    cf = os.path.join(p_dir, CONFIG_FILE_NAME)
+    p = S2SProject(directory=p_dir, config_file=cf,
+                   workers=args.workers,
+                   batch_size=args.batch_size,
+                   batch_wait=args.batch_wait / 1000,
+                   model_api=args.api)
+    if args.preload:
+        t = time.time()
+        p.preload_indices(['encoder', 'decoder'])
+        p.log_stage('indices', t)
+    if args.warmup:
+        warm_up(p, warmup_sentences)
+    return p
+
+
+def warm_up(project, sentences):
+    """
+    pays the first-use costs of a project before it serves requests:
+    indices, embedding norms, memory mapped files and the first
+    translations and projections (torch and sklearn)
+    """
+    t = time.time()
+    project.warm_up()
+    neighbors = ['decoder', 'encoder'] if project.has_neighbors else []
+    for sentence in sentences:
+        translations = translate(project, [sentence])
+        if neighbors:
+            all_neighbors(project, translations, neighbors,
+                          p_method=NEIGHBOR_P_METHOD, k=NEIGHBOR_K)
+    project.log_stage('warmup', t)
+
+
+def get_project(request):
+    """
+    :param request: request parameters
+    :return: the project of `project_id` -- or the default project
+    """
+    try:
+        if not has_request_context():
+            # precompute, benchmarks, ... -- not protected from unloading
+            return projects.get(request.get('project_id'))
+        project = projects.acquire(request.get('project_id'))
+    except KeyError:
+        abort(404, 'unknown project: ' + str(request.get('project_id')))
+    # held until the end of the request (see release_projects)
+    if 'projects' not in g:
+        g.projects = []
+    g.projects.append(project)
+    return project
 
 
 app.add_api('swagger.yaml')
 
 
+def neighbor_key(translation_id, neighbors):
+    return (translation_id, tuple(neighbors), NEIGHBOR_P_METHOD, NEIGHBOR_K)
+
+
+def token_neighbors(translation):
+    """
+    :return: the neighbors all_neighbors() stored for each token
+    """
+    return {
+        'encoder': [{k: enc[k] for k in ['neighbors'] if k in enc}
+                    for enc in translation['encoder']],
+        'decoder': [{k: dec[k] for k in ['neighbors', 'neighbor_context']
+                     if k in dec}
+                    for dec in translation['decoder'][0]]
+    }
+
+
+def apply_token_neighbors(translation, tokens):
+    for enc, n in zip(translation['encoder'], tokens['encoder']):
+        enc.update(n)
+    for dec, n in zip(translation['decoder'][0], tokens['decoder']):
+        dec.update(n)
+
+
+def translation_key(request):
+    project_id = projects.resolve_id(request.get('project_id'))
+    partials = request.get('partial', [''])
+    force_attn = request.get('force_attn', [''])
+    # Make empty lists empty:
+    partials = [] if partials == [''] else partials
+    force_attn = [] if force_attn == [''] else force_attn
+    return project_id + '|' + request['in'] + str(partials) + str(force_attn)
+
+
 def preload_cache(cache):
+    """
+    indexes all cached responses in directory `cache` by their request
+    -- the responses themselves are loaded on first access
+
+    :param cache: directory with .json responses
+    """
     if len(cache) > 0:
-        all_files = [os.path.join(cache, f) for f in os.listdir(cache) if
-                     os.path.isfile(os.path.join(cache, f))]
-        for file in all_files:
-            if file.endswith('.json'):
-                with open(file, 'r') as f:
-                    a = json.load(f)
-                    print(a['request'])
-                    request = a['request']
-                    neighbors = request.get('neighbors', [''])
-                    partials = request.get('partial', [''])
-                    force_attn = request.get('force_attn', [''])
-                    # Make empty lists empty:
-                    partials = [] if partials == [''] else partials
-                    neighbors = [] if neighbors == [''] else neighbors
-                    force_attn = [] if force_attn == [''] else force_attn
-                    translation_id = request['in'] + str(partials) + str(
-                        force_attn)
-                    cache_translate.preload(translation_id, [a])
-                    pre_cached.append(request)
+        for file, request in load_manifest(cache).items():
+            pre_cached_files[translation_key(request)] = file
+            pre_cached.append(request)
+        logging.info('indexed %d cached responses', len(pre_cached))
 
 
+def load_pre_cached(translation_id):
+    file = pre_cached_files.get(translation_id)
+    if not file:
+        return None
+    with open(file, 'r') as f:
+        translations = [freeze_translation(json.load(f))]
+    # regular (evictable) entries -- the files stay the persistent copy
+    cache_translate.add(translation_id, translations)
 
+    res = translations[0]
+    if 'allNeighbors' in res:
+        neighbors = res['request'].get('neighbors', [''])
+        neighbors = [] if neighbors == [''] else neighbors
+        cache_neighbors.add(neighbor_key(translation_id, neighbors),
+                            freeze({'neighbors': res['allNeighbors'],
+                                    'tokens': token_neighbors(res)}))
+    return translations
 
 
 if __name__ == '__main__':
     args = parser.parse_args()
-    app.run(port=int(args.port), debug=args.debug, host="0.0.0.0")
-else:
+    # connexion resolves the handlers (and loads the projects) in the
+    # module `server`, not in this one (__main__) -- run the app of that
+    # module, so routes, hooks and handlers share projects and caches
+    import server
+    server.app.run(port=int(args.port), debug=args.debug, host="0.0.0.0")
+elif multiprocessing.current_process().name == 'MainProcess':
+    # (spawned model workers import this module again -- without projects)
     args, _ = parser.parse_known_args()
+    projects.budget_mb = args.project_budget
+    if args.warmup:
+        with open(args.warmup, 'r') as f:
+            warmup_sentences = [l.strip() for l in f if l.strip()]
     find_and_load_project(args.dir)
+    if args.load_threads > 0:
+        # the backends (torch, onmt, ...) are imported by the loaders
+        projects.load_all(
+            threads=args.load_threads,
+            done=lambda: logging.info('import times:\n%s', import_report()))
+    cache_neighbors.k = args.neighbor_cache
     preload_cache(args.cache)
+    if args.store:
+        store = DiskCache(args.store, max_mb=args.store_mb)
+    if args.profile:
+        profiler = RequestProfiler(args.profile,
+                                   threshold_ms=args.profile_ms,
+                                   sample_rate=args.profile_rate,
+                                   keep=args.profile_keep,
+                                   interval_ms=args.profile_interval)
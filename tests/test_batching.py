@@ -0,0 +1,131 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from model_api.batcher import MicroBatcher
+from s2s.single_flight import SingleFlight
+
+
+class EchoModel:
+    """ translates every sentence to itself and records the calls """
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+        self.closed = False
+
+    def translate(self, in_text, partial_decode=[], attn_overwrite=[], k=5,
+                  attn=None, roundTo=5):
+        self.calls.append({'in_text': list(in_text), 'k': k,
+                           'partial_decode': partial_decode})
+        if self.fail:
+            raise RuntimeError('model failed')
+        return {i: {'text': sentence, 'k': k}
+                for i, sentence in enumerate(in_text)}
+
+    def close(self):
+        self.closed = True
+
+
+def test_single_flight_runs_once():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 42
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(flight.do, 'key', compute)
+        started.wait(5)
+        followers = [pool.submit(flight.do, 'key', compute)
+                     for _ in range(3)]
+        time.sleep(0.05)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert results == [42] * 4
+    assert len(calls) == 1
+    assert flight.in_flight == {}
+
+
+def test_single_flight_shares_exceptions_and_forgets_keys():
+    flight = SingleFlight()
+
+    def fail():
+        raise KeyError('missing')
+
+    with pytest.raises(KeyError):
+        flight.do('key', fail)
+    # a later call computes again
+    assert flight.do('key', lambda: 1) == 1
+
+
+def test_batcher_splits_batch_per_request():
+    model = EchoModel()
+    batcher = MicroBatcher(model, max_batch_size=16, max_wait=0.2)
+    requests = [['a b', 'c'], ['d'], ['e f g', 'h', 'i']]
+    with ThreadPoolExecutor(len(requests)) as pool:
+        replies = list(pool.map(batcher.translate, requests))
+    batcher.close()
+
+    for in_text, reply in zip(requests, replies):
+        assert sorted(reply) == list(range(len(in_text)))
+        assert [reply[i]['text'] for i in range(len(in_text))] == in_text
+    assert len(model.calls) == 1
+    assert sorted(model.calls[0]['in_text']) == \
+        sorted(s for in_text in requests for s in in_text)
+
+
+def test_batcher_groups_by_k_and_keeps_partial_decodes_apart():
+    model = EchoModel()
+    batcher = MicroBatcher(model, max_batch_size=16, max_wait=0.2)
+    with ThreadPoolExecutor(4) as pool:
+        k5 = [pool.submit(batcher.translate, [s], k=5) for s in 'ab']
+        k3 = pool.submit(batcher.translate, ['c'], k=3)
+        partial = pool.submit(batcher.translate, ['d'],
+                              partial_decode=['x'])
+        assert [f.result()[0]['text'] for f in k5] == ['a', 'b']
+        assert k3.result() == {0: {'text': 'c', 'k': 3}}
+        assert partial.result()[0]['text'] == 'd'
+    batcher.close()
+
+    batches = sorted(sorted(call['in_text']) for call in model.calls)
+    assert batches == [['a', 'b'], ['c'], ['d']]
+
+
+def test_batcher_respects_max_batch_size():
+    model = EchoModel()
+    batcher = MicroBatcher(model, max_batch_size=2, max_wait=0.2)
+    with ThreadPoolExecutor(4) as pool:
+        replies = list(pool.map(batcher.translate, [['a'], ['b'], ['c']]))
+    batcher.close()
+
+    assert [reply[0]['text'] for reply in replies] == ['a', 'b', 'c']
+    assert all(len(call['in_text']) <= 2 for call in model.calls)
+
+
+def test_batcher_forwards_exceptions():
+    batcher = MicroBatcher(EchoModel(fail=True), max_wait=0.01)
+    with pytest.raises(RuntimeError, match='model failed'):
+        batcher.translate(['a'])
+    batcher.close()
+
+
+def test_batcher_close():
+    model = EchoModel()
+    batcher = MicroBatcher(model, max_wait=0.01)
+    assert batcher.translate(['a']) == {0: {'text': 'a', 'k': 5}}
+    batcher.close()
+
+    assert model.closed
+    assert batcher.model_api is None
+    assert not batcher.thread.is_alive()
+    with pytest.raises(RuntimeError):
+        batcher.translate(['b'])
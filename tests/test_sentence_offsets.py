@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from index.sentenceOffsets import SentenceOffsets, without_padding
+
+# sentences of length 3, 0, 2 and 1
+OFFSETS = np.array([0, 3, 3, 5, 6])
+
+
+def brute_force(vectors):
+    """ exact search over `vectors` -- closest ids first """
+    def search(queries, fetch):
+        dists = np.abs(np.asarray(queries)[:, None] - vectors[None, :])
+        ids = np.argsort(dists, axis=1, kind='stable')[:, :fetch]
+        return ids, np.take_along_axis(dists, ids, axis=1)
+    return search
+
+
+def test_to_sentence_with_offsets():
+    offsets = SentenceOffsets(offsets=OFFSETS)
+    sentences, positions = offsets.to_sentence([0, 2, 3, 4, 5])
+    # sentence 1 is empty, id 3 is the start of sentence 2
+    assert sentences.tolist() == [0, 0, 2, 2, 3]
+    assert positions.tolist() == [0, 2, 0, 1, 0]
+
+
+def test_to_ids_round_trip():
+    offsets = SentenceOffsets(offsets=OFFSETS)
+    ids = np.arange(OFFSETS[-1])
+    assert offsets.to_ids(*offsets.to_sentence(ids)).tolist() == ids.tolist()
+    assert offsets.to_ids([0, 2, 3], [1, 1, 0]).tolist() == [1, 4, 5]
+
+
+def test_stride_fallback():
+    offsets = SentenceOffsets(stride=4)
+    sentences, positions = offsets.to_sentence([0, 3, 4, 9])
+    assert sentences.tolist() == [0, 0, 1, 2]
+    assert positions.tolist() == [0, 3, 0, 1]
+    assert offsets.to_ids(sentences, positions).tolist() == [0, 3, 4, 9]
+    assert offsets.max_length == 4
+
+
+def test_for_index_without_offsets_file(tmp_path):
+    offsets = SentenceOffsets.for_index(str(tmp_path / 'states.faiss'), 50)
+    assert offsets.offsets is None
+    assert offsets.stride == 50
+
+
+def test_needs_offsets_or_stride():
+    with pytest.raises(ValueError):
+        SentenceOffsets()
+
+
+def test_max_length():
+    assert SentenceOffsets(offsets=OFFSETS).max_length == 3
+
+
+def test_without_padding():
+    chunk = np.zeros((3, 4, 2), dtype='float32')
+    chunk[0, :2] = 1
+    chunk[2, :4] = 2
+    chunk[2, 1] = 0  # zero vector before the last token is kept
+    vectors, lengths = without_padding(chunk)
+    assert lengths.tolist() == [2, 0, 4]
+    assert len(vectors) == 6
+
+
+def test_search_excluding_skips_own_sentence():
+    offsets = SentenceOffsets(offsets=OFFSETS)
+    vectors = np.array([0., 1., 2., 10., 11., 12.])
+    search = brute_force(vectors)
+
+    queries = [0., 11.]
+    ids, dists = offsets.search_excluding(
+        search, queries, sentences=[0, 2], k=2, max_k=len(vectors))
+
+    # the ids 0-2 (sentence 0) and 3-4 (sentence 2) are left out
+    assert ids[0].tolist() == [3, 4]
+    assert ids[1].tolist() == [5, 2]
+    assert dists[0].tolist() == [10., 11.]
+
+
+def test_search_excluding_refetches():
+    # an approximate index that only finds half of the requested
+    # neighbors -- queries short of k are searched again with twice the k
+    offsets = SentenceOffsets(stride=2)
+    vectors = np.arange(16.)
+    calls = []
+
+    def search(queries, fetch):
+        calls.append((len(queries), fetch))
+        ids, dists = brute_force(vectors)(queries, fetch)
+        ids[:, fetch // 2:] = -1
+        return ids, dists
+
+    ids, _ = offsets.search_excluding(
+        search, [0., 15.], sentences=[0, 7], k=3, max_k=len(vectors))
+    assert ids[0].tolist() == [2, 3, 4]
+    assert ids[1].tolist() == [13, 12, 11]
+    # k + max_length, then both queries again
+    assert calls == [(2, 5), (2, 10)]
+
+
+def test_search_excluding_not_enough_candidates():
+    offsets = SentenceOffsets(offsets=OFFSETS)
+    vectors = np.array([0., 1., 2., 10., 11., 12.])
+
+    ids, _ = offsets.search_excluding(
+        brute_force(vectors), [0.], sentences=[0], k=5,
+        max_k=len(vectors))
+    # only the 3 ids of the other sentences remain
+    assert sorted(ids[0].tolist()) == [3, 4, 5]
+
+
+def test_search_excluding_missing_results():
+    offsets = SentenceOffsets(offsets=OFFSETS)
+
+    def search(queries, fetch):
+        ids = np.full((len(queries), fetch), -1)
+        ids[:, 0] = 5
+        return ids, np.zeros((len(queries), fetch))
+
+    ids, dists = offsets.search_excluding(
+        search, [0.], sentences=[0], k=2, max_k=6)
+    assert ids[0].tolist() == [5]
+    assert len(dists[0]) == 1